@@ -3,243 +3,2332 @@ import os
 import sys
 import re
 import time
+import io
 import json
+import queue
+import abc
+import ast
 import math
+import operator
 import random
-import turtle
-import difflib
+import hashlib
+import shutil
+import signal
+import functools
+import heapq
+import itertools
+import contextlib
+import contextvars
+import collections
+import importlib
+import atexit
 import logging
 import threading
-from datetime import datetime
+from datetime import datetime, timedelta
 
 
-try:
-    import pyttsx3
-    import sounddevice as sd
-    import soundfile as sf
-    import speech_recognition as sr
-    from duckduckgo_search import DDGS
-except Exception as e:
-    print("Missing dependency. Run:\n pip install pyttsx3 SpeechRecognition sounddevice soundfile duckduckgo-search")
-    raise e
+# heavy / optional dependencies are imported on first use (see lazy_import),
+# so the text REPL starts without audio, Tk or the network stack
+_PIP_NAMES = {
+    "pyttsx3": "pyttsx3",
+    "sounddevice": "sounddevice",
+    "soundfile": "soundfile",
+    "speech_recognition": "SpeechRecognition",
+    "duckduckgo_search": "duckduckgo-search",
+    "turtle": "tk (your Python needs Tkinter)",
+    "numpy": "numpy",
+    "PIL.Image": "pillow",
+    "PIL.ImageDraw": "pillow",
+    "webrtcvad": "webrtcvad",
+}
+_LOADED = {}
+
+def lazy_import(name):
+    mod = _LOADED.get(name)
+    if mod is None:
+        try:
+            mod = importlib.import_module(name)
+        except ImportError:
+            print(f"Missing dependency. Run:\n pip install {_PIP_NAMES.get(name, name)}")
+            raise
+        _LOADED[name] = mod
+    return mod
 
 
+HEADLESS = os.environ.get("LEXCHAT_HEADLESS", "") == "1"   # text only: no audio, Tk or network
 VOICE_RECORD_SECONDS = 4
+AUDIO_SAMPLE_RATE = 16000     # recognizers want 16 kHz mono 16-bit
+AUDIO_CHANNELS = 1
+AUDIO_DTYPE = "int16"         # capture format; float32 is converted to int16
+AUDIO_FLAC = False            # report / hand over FLAC-compressed payloads
+
+# voice-activity endpointing: stop recording as soon as the user stops talking
+VOICE_ENDPOINTING = True      # False restores the fixed VOICE_RECORD_SECONDS window
+VAD_FRAME_MS = 30
+VAD_LEADING_SILENCE = 4.0     # give up if no speech starts within this many seconds
+VAD_TRAILING_SILENCE = 0.7    # silence that ends an utterance
+VAD_MAX_SECONDS = 12.0        # longest single utterance
+VAD_PREROLL = 0.3             # audio kept from just before speech onset
+VAD_ENERGY_RATIO = 3.0        # speech must be this many times louder than the noise floor
+VAD_MIN_ENERGY = 200.0        # absolute int16 RMS threshold for speech
+VAD_FLOOR_MAX_RISE = 1.5      # a quiet frame counts as at most this times the noise floor
+VAD_WEBRTC = False            # use webrtcvad for the speech/non-speech decision
+ENV_DIR = "lexchat_env"
 LAST_SEARCH_FILE = "lexchat_env/last_search.json"
-HISTORY_FILE = "lexchat_env/lexchat_history.json"
+SEARCH_CACHE_FILE = "lexchat_env/search_cache.json"
+SEARCH_CACHE_TTL = 6 * 60 * 60   # seconds a cached result set stays fresh
+SEARCH_CACHE_MAX = 200           # cached queries kept before evicting the least recently used
+SEARCH_BACKEND = os.environ.get("LEXCHAT_SEARCH_BACKEND", "ddgs")   # ddgs / fixture
+SEARCH_TIMEOUT = 8.0             # seconds a whole search may take before giving up
+SEARCH_FIXTURE_FILE = "lexchat_env/search_fixtures.json"
+HISTORY_FILE = "lexchat_env/lexchat_history.jsonl"
+LEGACY_HISTORY_FILE = "lexchat_env/lexchat_history.json"
 LOG_FILE = "lexchat_env/lexchat.log"
 DEFAULT_VOICE_MODE = "calm"   # calm / balanced / energetic
 
+# history tuning
+HISTORY_FLUSH_SECONDS = 0.5   # max time an entry sits in the buffer
+HISTORY_FLUSH_BATCH = 32      # flush early once this many entries are buffered
+HISTORY_ROTATIONS = 3         # archives (.1 is newest) the old JSONL journal kept; imported once
+HISTORY_DB = os.environ.get("LEXCHAT_HISTORY_DB", "lexchat_env/lexchat_history.db")
+HISTORY_SEARCH_LIMIT = 20     # entries shown by "history search" / "history since"
+
+os.makedirs(ENV_DIR, exist_ok=True)
 logging.basicConfig(filename=LOG_FILE, level=logging.INFO,
                     format="%(asctime)s %(levelname)s: %(message)s")
 
 def now_str():
     return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
+
+class BatchWriter(abc.ABC):
+    # Entries are buffered in memory and written in batches by a background
+    # thread, so callers never touch the disk. Subclasses open their storage
+    # in _ensure_open() and store one batch in _write().
+    def __init__(self):
+        self._buffer = []
+        self._opened = False
+        self._closed = False
+        self._thread = None
+        self._cond = threading.Condition()
+        self._io_lock = threading.Lock()
+
+    @abc.abstractmethod
+    def _ensure_open(self):
+        ...
+
+    @abc.abstractmethod
+    def _write(self, batch):
+        # called with _io_lock held
+        ...
+
+    def _start_flusher(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="history-flusher", daemon=True)
+            self._thread.start()
+
+    def append(self, entry):
+        with self._cond:
+            self._buffer.append(entry)
+            self._start_flusher()
+            self._cond.notify()
+
+    def pending(self):
+        with self._cond:
+            return len(self._buffer)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._buffer and not self._closed:
+                    self._cond.wait()
+                if self._closed and not self._buffer:
+                    return
+                # give the batch a moment to fill before writing it out
+                deadline = time.monotonic() + HISTORY_FLUSH_SECONDS
+                while len(self._buffer) < HISTORY_FLUSH_BATCH and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            self.flush()
+
+    def flush(self):
+        with self._cond:
+            batch, self._buffer = self._buffer, []
+        if not batch:
+            return
+        self._ensure_open()
+        with self._io_lock:
+            try:
+                self._write(batch)
+            except Exception as e:
+                logging.warning("save_history error: %s", e)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+        self.flush()
+
+
+_HISTORY_TEXT_SKIP = {"type", "time", "mode", "session", "cached"}
+
+def history_text(entry):
+    # the words full-text search sees: every value but the bookkeeping fields
+    words = []
+    for key, value in entry.items():
+        if key in _HISTORY_TEXT_SKIP or isinstance(value, bool):
+            continue
+        if isinstance(value, (str, int, float)):
+            words.append(str(value))
+        elif isinstance(value, (list, tuple)):
+            words.extend(str(v) for v in value if v not in (None, ""))
+    return " ".join(w for w in words if w)
+
+
+class HistoryStore(BatchWriter):
+    # SQLite-backed history with a buffered append path; nothing is rotated
+    # away. (type, ts) and ts indexes serve "history since", an
+    # FTS5 table over history_text() serves "history search" (LIKE when the
+    # sqlite build has no FTS5), and a trigger keeps per-type counts so stats
+    # and count() never scan. The JSONL journal, its archives and the legacy
+    # JSON file are imported once, when the database is created.
+    SCHEMA_VERSION = 1
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS history (
+            id INTEGER PRIMARY KEY,
+            type TEXT NOT NULL,
+            ts TEXT NOT NULL,
+            session TEXT,
+            text TEXT NOT NULL,
+            data TEXT NOT NULL);
+        CREATE INDEX IF NOT EXISTS history_type_ts ON history(type, ts);
+        CREATE INDEX IF NOT EXISTS history_ts ON history(ts);
+        CREATE INDEX IF NOT EXISTS history_session ON history(session, ts) WHERE session IS NOT NULL;
+        CREATE TABLE IF NOT EXISTS history_counts (
+            type TEXT PRIMARY KEY, n INTEGER NOT NULL, first TEXT, last TEXT);
+        CREATE TRIGGER IF NOT EXISTS history_counted AFTER INSERT ON history BEGIN
+            INSERT INTO history_counts(type, n, first, last) VALUES (new.type, 1, new.ts, new.ts)
+            ON CONFLICT(type) DO UPDATE SET n = n + 1, first = min(first, excluded.first),
+                                            last = max(last, excluded.last);
+        END;
+    """
+    _FTS_SCHEMA = """
+        CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5(text, content='history', content_rowid='id');
+        CREATE TRIGGER IF NOT EXISTS history_indexed AFTER INSERT ON history BEGIN
+            INSERT INTO history_fts(rowid, text) VALUES (new.id, new.text);
+        END;
+    """
+
+    def __init__(self, path, journal=None, legacy_path=None):
+        super().__init__()
+        self.path = path
+        self.journal = journal
+        self.legacy_path = legacy_path
+        self.fts = False
+        self._db = None
+
+    def _ensure_open(self):
+        if self._opened:
+            return
+        with self._io_lock:
+            if self._opened:
+                return
+            sqlite3 = lazy_import("sqlite3")
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.executescript(self._SCHEMA)
+            try:
+                db.executescript(self._FTS_SCHEMA)
+                self.fts = True
+            except sqlite3.OperationalError as e:
+                logging.info("no FTS5 in this sqlite (%s); history search uses LIKE", e)
+            self._db = db
+            if db.execute("PRAGMA user_version").fetchone()[0] < self.SCHEMA_VERSION:
+                self._import_files()
+                db.execute(f"PRAGMA user_version={self.SCHEMA_VERSION}")
+            self._opened = True
+
+    def _import_files(self):
+        # oldest first: legacy JSON, journal archives (.3 .. .1), live journal
+        entries = []
+        try:
+            if self.legacy_path and os.path.exists(self.legacy_path):
+                with open(self.legacy_path, "r", encoding="utf-8") as f:
+                    entries.extend(json.load(f))
+            if self.journal:
+                paths = [f"{self.journal}.{i}" for i in range(HISTORY_ROTATIONS, 0, -1)] + [self.journal]
+                for path in paths:
+                    if not os.path.exists(path):
+                        continue
+                    with open(path, "r", encoding="utf-8") as f:
+                        for line in f:
+                            try:
+                                entries.append(json.loads(line))
+                            except ValueError:
+                                continue
+        except Exception as e:
+            logging.warning("history import error: %s", e)
+        entries = [e for e in entries if isinstance(e, dict)]
+        if entries:
+            self._insert(entries)
+            logging.info("imported %d history entries into %s", len(entries), self.path)
+
+    def _insert(self, entries):
+        rows = [(e.get("type") or "unknown", e.get("time") or now_str(), e.get("session"),
+                 history_text(e), json.dumps(e, ensure_ascii=False)) for e in entries]
+        with self._db:
+            self._db.executemany("INSERT INTO history(type, ts, session, text, data) VALUES (?, ?, ?, ?, ?)", rows)
+
+    def _write(self, batch):
+        self._insert(batch)
+
+    def _query(self, sql, args=()):
+        self._ensure_open()
+        self.flush()
+        with self._io_lock:
+            return self._db.execute(sql, args).fetchall()
+
+    def tail(self, n=8, session=None):
+        # the newest n entries (all of them when n is None), oldest first
+        limit = -1 if n is None else n
+        if session:
+            rows = self._query("SELECT data FROM history WHERE session = ? ORDER BY id DESC LIMIT ?", (session, limit))
+        else:
+            rows = self._query("SELECT data FROM history ORDER BY id DESC LIMIT ?", (limit,))
+        return [json.loads(r[0]) for r in reversed(rows)]
+
+    def count(self, session=None):
+        if session:
+            return self._query("SELECT COUNT(*) FROM history WHERE session = ?", (session,))[0][0]
+        self._ensure_open()
+        pending = self.pending()
+        with self._io_lock:
+            return self._db.execute("SELECT COALESCE(SUM(n), 0) FROM history_counts").fetchone()[0] + pending
+
+    def search(self, term, kind=None, session=None, limit=HISTORY_SEARCH_LIMIT):
+        # newest entries whose words start with every word of term
+        words = re.findall(r"\w+", (term or "").lower())
+        if not words:
+            return []
+        where, args = [], []
+        if self.fts:
+            sql = "SELECT h.data FROM history_fts f JOIN history h ON h.id = f.rowid WHERE history_fts MATCH ?"
+            args.append(" ".join(f'"{w}"*' for w in words))
+            order = "f.rowid"
+        else:
+            sql = "SELECT h.data FROM history h WHERE 1"
+            for w in words:
+                where.append("h.text LIKE ?")
+                args.append(f"%{w}%")
+            order = "h.id"
+        if kind:
+            where.append("h.type = ?")
+            args.append(kind)
+        else:
+            where.append("NOT (h.type = 'command' AND h.text LIKE 'history %')")   # earlier lookups
+        if session:
+            where.append("h.session = ?")
+            args.append(session)
+        sql += "".join(f" AND {w}" for w in where) + f" ORDER BY {order} DESC LIMIT ?"
+        return [json.loads(r[0]) for r in self._query(sql, args + [limit])]
+
+    def since(self, when, kind=None, session=None, limit=HISTORY_SEARCH_LIMIT):
+        # -> (how many entries since `when`, the newest `limit` of them)
+        where, args = ["ts >= ?"], [when]
+        if kind:
+            where.append("type = ?")
+            args.append(kind)
+        if session:
+            where.append("session = ?")
+            args.append(session)
+        cond = " AND ".join(where)
+        total = self._query(f"SELECT COUNT(*) FROM history WHERE {cond}", args)[0][0]
+        rows = self._query(f"SELECT data FROM history WHERE {cond} ORDER BY ts DESC, id DESC LIMIT ?", args + [limit])
+        return total, [json.loads(r[0]) for r in rows]
+
+    def stats(self):
+        # -> {type: {"count", "first", "last"}}, most frequent first
+        rows = self._query("SELECT type, n, first, last FROM history_counts ORDER BY n DESC")
+        return {t: {"count": n, "first": first, "last": last} for t, n, first, last in rows}
+
+    def close(self):
+        super().close()
+        if self._db is not None:
+            with self._io_lock:
+                self._db.close()
+                self._db = None
+                self._opened = False
+
+
+HISTORY = HistoryStore(HISTORY_DB, HISTORY_FILE, LEGACY_HISTORY_FILE)
+atexit.register(HISTORY.close)
+
+
+# ---- timing ----
+# Stage timings (record, recognize, dispatch, search, speak, turn) kept in
+# rolling windows per command type. Spans taken while a turn is open are held
+# until the turn knows which command it ran, then filed under that name.
+METRICS_ENABLED = os.environ.get("LEXCHAT_METRICS", "1") != "0"
+METRICS_WINDOW = 512                 # samples kept per (stage, command)
+METRICS_FILE = "lexchat_env/lexchat_stats.json"
+
+class _Span:
+    __slots__ = ("timer", "stage", "kind", "start")
+
+    def __init__(self, timer, stage, kind):
+        self.timer, self.stage, self.kind = timer, stage, kind
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timer.record(self.stage, (time.perf_counter() - self.start) * 1000, self.kind)
+        return False
+
+_NO_SPAN = contextlib.nullcontext()
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    k = max(0, min(len(sorted_values) - 1, math.ceil(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+class StageTimer:
+    def __init__(self, window=METRICS_WINDOW, enabled=METRICS_ENABLED):
+        self.enabled = enabled
+        self.window = window
+        self._samples = {}     # (stage, kind) -> deque of ms
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def span(self, stage, kind=None):
+        return _Span(self, stage, kind) if self.enabled else _NO_SPAN
+
+    def begin_turn(self):
+        # False when a turn is already open on this thread (the caller doesn't own it)
+        if not self.enabled or getattr(self._local, "turn", None) is not None:
+            return False
+        self._local.turn = [None, []]
+        return True
+
+    def set_kind(self, kind):
+        turn = getattr(self._local, "turn", None)
+        if turn is not None:
+            turn[0] = kind
+
+    def kind(self):
+        turn = getattr(self._local, "turn", None)
+        return turn[0] if turn is not None else None
+
+    def end_turn(self):
+        turn = getattr(self._local, "turn", None)
+        self._local.turn = None
+        if turn is not None:
+            for stage, ms in turn[1]:
+                self._add(stage, turn[0] or "none", ms)
+
+    def record(self, stage, ms, kind=None):
+        if not self.enabled:
+            return
+        turn = getattr(self._local, "turn", None)
+        if kind is None and turn is not None:
+            turn[1].append((stage, ms))
+        else:
+            self._add(stage, kind or "-", ms)
+
+    def _add(self, stage, kind, ms):
+        with self._lock:
+            samples = self._samples.get((stage, kind))
+            if samples is None:
+                samples = self._samples[(stage, kind)] = collections.deque(maxlen=self.window)
+            samples.append(ms)
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+
+    def summary(self):
+        # {stage: {command: {count, p50, p95, p99, max}}}, with an "all" row per stage
+        with self._lock:
+            snapshot = {key: list(v) for key, v in self._samples.items()}
+        grouped = {}
+        for (stage, kind), values in snapshot.items():
+            kinds = grouped.setdefault(stage, {})
+            kinds[kind] = values
+            kinds.setdefault("all", []).extend(values)
+        out = {}
+        for stage, kinds in grouped.items():
+            out[stage] = {}
+            for kind, values in sorted(kinds.items()):
+                values.sort()
+                out[stage][kind] = {"count": len(values),
+                                    **{f"p{p}": round(percentile(values, p), 3) for p in (50, 95, 99)},
+                                    "max": round(values[-1], 3)}
+        return out
+
+    def export(self, path=METRICS_FILE):
+        data = {"time": now_str(), "python": sys.version.split()[0], "platform": sys.platform,
+                "window": self.window, "stages": self.summary()}
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp, path)
+        return path
+
+METRICS = StageTimer()
+
+def timed(stage):
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not METRICS.enabled:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                METRICS.record(stage, (time.perf_counter() - start) * 1000)
+        return wrapper
+    return deco
+
 def save_history(entry: dict):
+    session = _SESSION.get()
+    if session is not None:
+        entry = {**entry, "session": session.id}
+    HISTORY.append(entry)
+
+
+VOICE_PROFILES_FILE = "lexchat_env/voice_profiles.json"
+# built-in profiles; "voice" is "female"/"male" (picked from the installed
+# voices) or a concrete voice id. User profiles from VOICE_PROFILES_FILE extend these.
+VOICE_PROFILES = {
+    "calm": {"rate": 150, "volume": 0.85, "voice": "female"},
+    "balanced": {"rate": 175, "volume": 0.95, "voice": "male"},
+    "energetic": {"rate": 200, "volume": 1.0, "voice": "male"},
+}
+_user_profiles_loaded = False
+
+def voice_profiles():
+    global _user_profiles_loaded
+    if not _user_profiles_loaded:
+        _user_profiles_loaded = True
+        if os.path.exists(VOICE_PROFILES_FILE):
+            try:
+                with open(VOICE_PROFILES_FILE, "r", encoding="utf-8") as f:
+                    VOICE_PROFILES.update(json.load(f))
+            except Exception as e:
+                logging.warning("could not load voice profiles: %s", e)
+    return VOICE_PROFILES
+
+def save_voice_profile(name, rate, volume, voice=None):
+    profiles = voice_profiles()
+    profiles[name] = {"rate": int(rate), "volume": float(volume), "voice": voice}
     try:
-        data = []
-        if os.path.exists(HISTORY_FILE):
-            with open(HISTORY_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
-        data.append(entry)
-        # keep last 300
-        with open(HISTORY_FILE, "w", encoding="utf-8") as f:
-            json.dump(data[-300:], f, indent=2)
+        user = {}
+        if os.path.exists(VOICE_PROFILES_FILE):
+            with open(VOICE_PROFILES_FILE, "r", encoding="utf-8") as f:
+                user = json.load(f)
+        user[name] = profiles[name]
+        with open(VOICE_PROFILES_FILE, "w", encoding="utf-8") as f:
+            json.dump(user, f, indent=2)
     except Exception as e:
-        logging.warning("save_history error: %s", e)
-
-
-def init_engine(mode=DEFAULT_VOICE_MODE):
-    engine = pyttsx3.init()
-    voices = engine.getProperty("voices")
-    # choose defensively
-    voice_female = 1 if len(voices) > 1 else 0
-    voice_male = 0
-    if mode == "calm":
-        rate = 150
-        vol = 0.85
-        vid = voices[voice_female].id
-    elif mode == "balanced":
-        rate = 175
-        vol = 0.95
-        vid = voices[voice_male].id
-    else:
-        rate = 200
-        vol = 1.0
-        vid = voices[voice_male].id
-    engine.setProperty("rate", rate)
-    engine.setProperty("volume", vol)
-    try:
-        engine.setProperty("voice", vid)
-    except Exception:
-        pass
-    return engine
+        logging.warning("could not save voice profile: %s", e)
+    return profiles[name]
+
+
+class EngineManager:
+    # pyttsx3.init() hands back one engine per driver anyway, so keep that
+    # single engine and resolve every profile to concrete properties up front.
+    # Switching modes is then just a property swap.
+    def __init__(self, profiles):
+        self.engine = lazy_import("pyttsx3").init()
+        self.voice_ids = [v.id for v in self.engine.getProperty("voices")]
+        self.profiles = {}
+        self.current = None
+        self.last_switch_ms = None
+        self._applied = {}
+        for name, spec in profiles.items():
+            self.add_profile(name, **spec)
+
+    def _resolve_voice(self, voice):
+        if not self.voice_ids:
+            return None
+        if voice == "female":
+            # choose defensively
+            return self.voice_ids[1 if len(self.voice_ids) > 1 else 0]
+        if voice in (None, "", "male"):
+            return self.voice_ids[0]
+        if voice in self.voice_ids:
+            return voice
+        if str(voice).isdigit() and int(voice) < len(self.voice_ids):
+            return self.voice_ids[int(voice)]
+        logging.warning("unknown voice id %s, using default", voice)
+        return self.voice_ids[0]
+
+    def add_profile(self, name, rate=175, volume=1.0, voice=None):
+        self.profiles[name] = {"rate": int(rate), "volume": float(volume), "voice": self._resolve_voice(voice)}
+
+    def signature(self, name):
+        # identifies the exact sound of a mode; changes whenever its profile does
+        props = self.profiles.get(name) or self.profiles[DEFAULT_VOICE_MODE]
+        return hashlib.sha1(json.dumps([name, props], sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+    def switch(self, name):
+        start = time.perf_counter()
+        props = self.profiles.get(name) or self.profiles[DEFAULT_VOICE_MODE]
+        for key, value in props.items():
+            if value is None or self._applied.get(key) == value:
+                continue
+            try:
+                self.engine.setProperty(key, value)
+                self._applied[key] = value
+            except Exception as e:
+                logging.warning("could not set %s=%s: %s", key, value, e)
+        self.current = name
+        self.last_switch_ms = (time.perf_counter() - start) * 1000
+        logging.info("voice switch to %s took %.2f ms", name, self.last_switch_ms)
+        return self.engine
 
 def split_sentences(text):
     parts = re.split(r'(?<=[.!?])\s+', text.strip())
     return [p.strip() for p in parts if p.strip()]
 
-def speak_natural(engine, text, pause=0.34):
+def speak_natural(engine, text, pause=0.34, should_stop=None):
     if not text:
         return
     for p in split_sentences(text):
+        if should_stop and should_stop():
+            return
         engine.say(p)
         engine.runAndWait()
         time.sleep(pause)
 
-def respond(engine, text, pause=0.34, log=True):
+
+# speech priorities: lower is spoken first
+SPEECH_URGENT = 0
+SPEECH_NORMAL = 5
+SPEECH_LOW = 9
+SPEECH_BACKGROUND = 10   # phrase rendering; never counted by wait_idle
+PLAYBACK_POLL = 0.02     # seconds between barge-in checks during cached playback
+
+PHRASE_CACHE_DIR = "lexchat_env/phrase_cache"
+PHRASE_CACHE_ENABLED = os.environ.get("LEXCHAT_PHRASE_CACHE", "1") != "0"
+
+
+class PhraseCache:
+    # Fixed assistant phrases rendered once per voice profile with
+    # engine.save_to_file and then played back as audio. Files live under
+    # <root>/<profile signature>/<sha1 of text>.wav, so editing a profile just
+    # points at a fresh directory; directories no profile uses are pruned.
+    def __init__(self, root=PHRASE_CACHE_DIR):
+        self.root = root
+        self.phrases = set()
+        self._ready = set()    # paths of rendered files
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, signature, text):
+        digest = hashlib.sha1(text.encode("utf-8")).hexdigest()[:20]
+        return os.path.join(self.root, signature, digest + ".wav")
+
+    def get(self, signature, text):
+        if text not in self.phrases:
+            return None
+        path = self.path(signature, text)
+        if path in self._ready:
+            self.hits += 1
+            return path
+        self.misses += 1
+        return None
+
+    def pending(self, signature):
+        # phrases this profile has no audio for yet
+        todo = []
+        for text in sorted(self.phrases):
+            path = self.path(signature, text)
+            if path in self._ready:
+                continue
+            if os.path.exists(path) and os.path.getsize(path) > 0:
+                self._ready.add(path)
+            else:
+                todo.append(text)
+        return todo
+
+    def render(self, engine, signature, text):
+        path = self.path(signature, text)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path[:-len(".wav")] + ".tmp.wav"
+        engine.save_to_file(text, tmp)
+        engine.runAndWait()
+        if os.path.exists(tmp) and os.path.getsize(tmp) > 0:
+            os.replace(tmp, path)
+            self._ready.add(path)
+            return path
+        logging.warning("phrase render produced no audio for %r", text)
+        return None
+
+    def prune(self, signatures):
+        if not os.path.isdir(self.root):
+            return
+        for name in os.listdir(self.root):
+            if name not in signatures:
+                shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+                self._ready = {p for p in self._ready if os.path.basename(os.path.dirname(p)) != name}
+
+def play_audio_file(path, should_stop=None):
+    # -> False when should_stop() cut playback short; polled instead of
+    # blocking in sd.wait() so barge-in can stop a cached phrase mid-way
+    sf = lazy_import("soundfile")
+    sd = lazy_import("sounddevice")
+    data, rate = sf.read(path, dtype="int16")
+    sd.play(data, rate)
+    end = time.monotonic() + len(data) / rate
+    while time.monotonic() < end:
+        if should_stop and should_stop():
+            sd.stop()
+            return False
+        time.sleep(min(PLAYBACK_POLL, max(0.0, end - time.monotonic())))
+    sd.wait()
+    return True
+
+
+class Speaker:
+    # Owns the pyttsx3 engine on a dedicated thread. say() only enqueues, so
+    # the REPL never waits for audio unless it asks to via wait_idle().
+    def __init__(self, mode=DEFAULT_VOICE_MODE):
+        self.mode = mode
+        self._queue = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._generation = 0
+        self._pending = 0
+        self._idle = threading.Condition()
+        self._thread = None
+        self._manager = None
+        self.phrases = PhraseCache() if PHRASE_CACHE_ENABLED else None
+        self.enabled = True
+
+    @property
+    def last_switch_ms(self):
+        return self._manager.last_switch_ms if self._manager else None
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="speaker", daemon=True)
+            self._thread.start()
+
+    def _put(self, priority, kind, payload):
+        if not self.enabled:
+            return
+        with self._idle:
+            self._pending += 1
+            self._start()
+            self._queue.put((priority, next(self._seq), self._generation, kind, payload))
+
+    def _put_background(self, kind, payload):
+        self._queue.put((SPEECH_BACKGROUND, next(self._seq), self._generation, kind, payload))
+
+    def say(self, text, pause=0.34, priority=SPEECH_NORMAL):
+        if text:
+            self._put(priority, "say", (text, pause, METRICS.kind()))
+
+    def warm(self, phrases=()):
+        # build the engine and resolve all profiles now instead of on first speech,
+        # then render the fixed phrases for the current mode in the background
+        if self.phrases is not None:
+            self.phrases.phrases.update(phrases)
+        self._put(SPEECH_URGENT, "warm", None)
+
+    def set_mode(self, mode):
+        # runs ahead of anything already queued so the next utterance uses it;
+        # the returned event fires once the switch has been applied
+        done = threading.Event()
+        if not self.enabled:
+            self.mode = mode
+            done.set()
+        self._put(SPEECH_URGENT, "mode", (mode, done))
+        return done
+
+    def add_profile(self, name, spec):
+        self._put(SPEECH_URGENT, "profile", (name, spec))
+
+    def cancel(self, min_priority=SPEECH_URGENT):
+        # barge-in: drop queued speech at or below the given importance and
+        # stop the current utterance at its next sentence boundary
+        kept = []
+        with self._idle:
+            self._generation += 1
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item[3] == "say" and item[0] >= min_priority:
+                    self._pending -= 1
+                else:
+                    kept.append(item[:2] + (self._generation,) + item[3:])
+            for item in kept:
+                self._queue.put(item)
+            self._idle.notify_all()
+
+    @property
+    def busy(self):
+        return self._pending > 0
+
+    def wait_idle(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._idle:
+            while self._pending > 0:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+    def _stale(self, generation):
+        return generation != self._generation
+
+    def _queue_renders(self):
+        if self.phrases is None or not self.phrases.phrases:
+            return
+        signature = self._manager.signature(self.mode)
+        self.phrases.prune({self._manager.signature(name) for name in self._manager.profiles})
+        for text in self.phrases.pending(signature):
+            self._put_background("render", (self.mode, signature, text))
+
+    def _speak(self, text, pause, generation):
+        path = self.phrases.get(self._manager.signature(self.mode), text) if self.phrases else None
+        if path:
+            try:
+                if play_audio_file(path, should_stop=lambda: self._stale(generation)):
+                    time.sleep(pause)
+                return
+            except Exception as e:
+                logging.warning("cached phrase playback failed, speaking instead: %s", e)
+        speak_natural(self._manager.engine, text, pause, should_stop=lambda: self._stale(generation))
+
+    def _run(self):
+        while True:
+            priority, _, generation, kind, payload = self._queue.get()
+            try:
+                if self._manager is None:
+                    self._manager = EngineManager(voice_profiles())
+                    self._manager.switch(self.mode)
+                if kind == "warm":
+                    self._queue_renders()
+                elif kind == "mode":
+                    self.mode, done = payload
+                    self._manager.switch(self.mode)
+                    done.set()
+                    self._queue_renders()
+                elif kind == "profile":
+                    self._manager.add_profile(payload[0], **payload[1])
+                    if payload[0] == self.mode:
+                        self._queue_renders()
+                elif kind == "render":
+                    mode, signature, text = payload
+                    # skip work a later mode switch or profile edit made pointless
+                    if mode == self.mode and signature == self._manager.signature(mode):
+                        self.phrases.render(self._manager.engine, signature, text)
+                elif kind == "say" and not self._stale(generation):
+                    text, pause, command = payload
+                    with METRICS.span("speak", command or "-"):
+                        self._speak(text, pause, generation)
+            except Exception as e:
+                logging.error("speaker error: %s", e)
+            finally:
+                if kind != "render":
+                    with self._idle:
+                        self._pending -= 1
+                        self._idle.notify_all()
+
+
+def respond(engine, text, pause=0.34, log=True, priority=SPEECH_NORMAL):
+    session = _SESSION.get()
+    if session is not None:
+        # server sessions get the text back in the reply, not through the speaker
+        if log:
+            logging.info("SPEAK[%s]: %s", session.id, text)
+        session.say(text)
+        return
     print("LEXchat:", text)
     if log:
         logging.info("SPEAK: %s", text)
-    speak_natural(engine, text, pause)
+    if _BATCH_TURN is not None:
+        _BATCH_TURN.said.append(text)
+    engine.say(text, pause, priority)
+
 
+ENGINE = Speaker(DEFAULT_VOICE_MODE)
 
-ENGINE = init_engine(DEFAULT_VOICE_MODE)
+def headless_unavailable(feature):
+    if HEADLESS:
+        respond(ENGINE, f"{feature} isn't available in headless text mode.")
+        return True
+    return False
 
 def set_voice_mode(mode):
-    global ENGINE
     mode = mode.lower()
-    if mode not in ("calm","balanced","energetic"):
-        respond(ENGINE, "Voice mode not recognized. Use calm, balanced, or energetic.")
+    if mode not in voice_profiles():
+        respond(ENGINE, f"Voice mode not recognized. Use {', '.join(voice_profiles())}.")
+        return
+    if _SESSION.get() is not None:
+        _SESSION.get().voice_mode = mode
+        respond(ENGINE, f"Voice mode set to {mode}.")
         return
-    ENGINE = init_engine(mode)
+    # the speaker thread applies and logs the switch; don't wait for it here
+    ENGINE.set_mode(mode)
     respond(ENGINE, f"Voice mode set to {mode}.")
 
 
-def record_audio(filename="voice_temp.wav", duration=VOICE_RECORD_SECONDS, fs=44100):
+def define_voice_profile(name, rate, volume, voice=None):
+    spec = save_voice_profile(name, rate, volume, voice)
+    ENGINE.add_profile(name, spec)
+    respond(ENGINE, f"Saved voice profile {name}. Say set voice {name} to use it.")
+
+
+def _input_rate(sd, rate, dtype):
+    # prefer capturing at the target rate; fall back to the device default
+    try:
+        sd.check_input_settings(samplerate=rate, channels=AUDIO_CHANNELS, dtype=dtype)
+        return rate
+    except Exception:
+        return int(sd.query_devices(kind="input")["default_samplerate"])
+
+RESAMPLE_TAPS = 101           # fallback anti-alias filter length when scipy is missing
+_SCIPY_SIGNAL = None           # scipy.signal once looked up, False when not installed
+
+def _scipy_signal():
+    global _SCIPY_SIGNAL
+    if _SCIPY_SIGNAL is None:
+        try:
+            _SCIPY_SIGNAL = importlib.import_module("scipy.signal")
+        except ImportError:
+            _SCIPY_SIGNAL = False
+    return _SCIPY_SIGNAL or None
+
+def lowpass_taps(cutoff, taps=RESAMPLE_TAPS):
+    # windowed-sinc FIR; cutoff is a fraction of the sample rate (0..0.5)
+    np = lazy_import("numpy")
+    n = np.arange(taps) - (taps - 1) / 2
+    h = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(taps)
+    return (h / h.sum()).astype(np.float32)
+
+def resample(samples, src_rate, dst_rate):
+    np = lazy_import("numpy")
+    if src_rate == dst_rate or len(samples) == 0:
+        return samples
+    x = samples.astype(np.float32)
+    sps = _scipy_signal()
+    if sps is not None:
+        g = math.gcd(int(src_rate), int(dst_rate))
+        out = sps.resample_poly(x, int(dst_rate) // g, int(src_rate) // g)
+    else:
+        if dst_rate < src_rate:
+            # low-pass under the new Nyquist first so downsampling doesn't alias
+            x = np.convolve(x, lowpass_taps(0.45 * dst_rate / src_rate), mode="same")
+        n_out = int(round(len(samples) * dst_rate / src_rate))
+        src_t = np.arange(len(samples)) / src_rate
+        dst_t = np.arange(n_out) / dst_rate
+        out = np.interp(dst_t, src_t, x)
+    if samples.dtype.kind == "i":
+        info = np.iinfo(samples.dtype)
+        out = np.clip(np.round(out), info.min, info.max)
+    return out.astype(samples.dtype)
+
+def to_pcm16(samples):
+    np = lazy_import("numpy")
+    samples = np.asarray(samples).reshape(-1)
+    if samples.dtype.kind == "f":
+        samples = np.clip(samples, -1.0, 1.0) * 32767
+    return samples.astype("<i2")
+
+def to_audio_data(samples, rate=AUDIO_SAMPLE_RATE):
+    sr = lazy_import("speech_recognition")
+    return sr.AudioData(to_pcm16(samples).tobytes(), rate, 2)
+
+def audio_payload(audio, flac=None):
+    # the bytes a recognizer would receive for this utterance
+    flac = AUDIO_FLAC if flac is None else flac
+    return audio.get_flac_data() if flac else audio.get_raw_data()
+
+class Endpointer:
+    # Frame-by-frame speech endpointing. Energy based by default: a frame is
+    # speech when its RMS clears an adaptive noise floor; webrtcvad is used
+    # instead when VAD_WEBRTC is set and the package is installed.
+    def __init__(self, rate=AUDIO_SAMPLE_RATE, frame_ms=VAD_FRAME_MS, leading=None, trailing=None, max_seconds=None):
+        self.rate = rate
+        self.frame_ms = frame_ms
+        self.leading_frames = int((leading if leading is not None else VAD_LEADING_SILENCE) * 1000 / frame_ms)
+        self.trailing_frames = int((trailing if trailing is not None else VAD_TRAILING_SILENCE) * 1000 / frame_ms)
+        self.max_frames = int((max_seconds if max_seconds is not None else VAD_MAX_SECONDS) * 1000 / frame_ms)
+        # seeded from the fixed threshold, not the first frame, which may already be speech
+        self.noise_floor = VAD_MIN_ENERGY / VAD_ENERGY_RATIO
+        self.frames = 0
+        self.speech_start = None
+        self.silence_run = 0
+        self.state = "waiting"   # waiting -> speech -> done | timeout | max
+        self._webrtc = None
+        if VAD_WEBRTC and rate in (8000, 16000, 32000, 48000) and frame_ms in (10, 20, 30):
+            try:
+                self._webrtc = lazy_import("webrtcvad").Vad(2)
+            except ImportError:
+                logging.warning("webrtcvad not installed, using energy endpointing")
+
+    def is_speech(self, frame):
+        np = lazy_import("numpy")
+        if self._webrtc is not None:
+            return self._webrtc.is_speech(to_pcm16(frame).tobytes(), self.rate)
+        rms = float(np.sqrt(np.mean(np.square(frame.astype(np.float32))))) if len(frame) else 0.0
+        speech = rms > max(VAD_MIN_ENERGY, self.noise_floor * VAD_ENERGY_RATIO)
+        if not speech:
+            # track slow changes in background noise
+            self.noise_floor = 0.95 * self.noise_floor + 0.05 * min(rms, self.noise_floor * VAD_FLOOR_MAX_RISE)
+        return speech
+
+    def feed(self, frame):
+        self.frames += 1
+        speech = self.is_speech(frame)
+        if self.state == "waiting":
+            if speech:
+                self.state = "speech"
+                self.speech_start = self.frames - 1
+            elif self.frames >= self.leading_frames:
+                self.state = "timeout"
+        elif self.state == "speech":
+            self.silence_run = 0 if speech else self.silence_run + 1
+            if self.silence_run >= self.trailing_frames:
+                self.state = "done"
+            elif self.frames - self.speech_start >= self.max_frames:
+                self.state = "max"
+        return self.state
+
+
+VOICE_TURN_METRICS = collections.deque(maxlen=200)
+
+def _record_turn_metrics(captured, ended):
+    saved = VOICE_RECORD_SECONDS - captured
+    VOICE_TURN_METRICS.append({"captured": round(captured, 3), "fixed": VOICE_RECORD_SECONDS,
+                               "saved": round(saved, 3), "ended": ended, "time": now_str()})
+    logging.info("voice turn: captured %.2fs vs %ss fixed window (%+.2fs), ended by %s",
+                 captured, VOICE_RECORD_SECONDS, -saved, ended)
+
+def capture_utterance(sd, rate, dtype):
+    # stream from the microphone until the endpointer says the user is done
+    np = lazy_import("numpy")
+    fs = _input_rate(sd, rate, dtype)
+    frame_len = int(fs * VAD_FRAME_MS / 1000)
+    preroll = collections.deque(maxlen=max(1, int(VAD_PREROLL * 1000 / VAD_FRAME_MS)))
+    frames = []
+    ep = Endpointer(fs)
+    with sd.InputStream(samplerate=fs, channels=AUDIO_CHANNELS, dtype=dtype, blocksize=frame_len) as stream:
+        while True:
+            block, _overflow = stream.read(frame_len)
+            frame = block[:, 0].copy() if block.ndim > 1 else block.copy()
+            state = ep.feed(frame)
+            if state == "waiting":
+                preroll.append(frame)
+                continue
+            if state == "timeout":
+                break
+            if not frames:
+                frames.extend(preroll)
+            frames.append(frame)
+            if state in ("done", "max"):
+                break
+    if not frames:
+        return None, ep.state
+    samples = resample(np.concatenate(frames), fs, rate)
+    return samples, ep.state
+
+@timed("record")
+def record_audio(duration=VOICE_RECORD_SECONDS, rate=None, dtype=None, endpointing=None):
+    rate = rate or AUDIO_SAMPLE_RATE
+    dtype = dtype or AUDIO_DTYPE
+    endpointing = VOICE_ENDPOINTING if endpointing is None else endpointing
     try:
-        respond(ENGINE, f"Recording for {duration} seconds...", pause=0.12)
-        recording = sd.rec(int(duration * fs), samplerate=fs, channels=1)
-        sd.wait()
-        sf.write(filename, recording, fs)
+        sd = lazy_import("sounddevice")
+        if endpointing:
+            respond(ENGINE, "Listening...", pause=0.08)
+        else:
+            respond(ENGINE, f"Recording for {duration} seconds...", pause=0.12)
+        # the cue queues behind any pending prompt; let both finish so the
+        # microphone doesn't pick them up
+        ENGINE.wait_idle()
+        if endpointing:
+            samples, ended = capture_utterance(sd, rate, dtype)
+            if samples is None:
+                _record_turn_metrics(0.0, ended)
+                respond(ENGINE, "I didn't hear anything.", pause=0.08)
+                return None
+            _record_turn_metrics(len(samples) / rate, ended)
+        else:
+            fs = _input_rate(sd, rate, dtype)
+            recording = sd.rec(int(duration * fs), samplerate=fs, channels=AUDIO_CHANNELS, dtype=dtype)
+            sd.wait()
+            samples = resample(recording[:, 0] if recording.ndim > 1 else recording, fs, rate)
+        audio = to_audio_data(samples, rate)
         respond(ENGINE, "Finished recording.", pause=0.08)
-        logging.info("Saved recording to %s", filename)
-        return filename
+        logging.info("Captured %.2fs at %d Hz (%d payload bytes)", len(samples) / rate, rate,
+                     len(audio_payload(audio)))
+        return audio
     except Exception as e:
         logging.error("record_audio error: %s", e)
         respond(ENGINE, "Recording failed. Check microphone permissions.", pause=0.1)
         return None
 
-def recognize_file(filename="voice_temp.wav"):
-    r = sr.Recognizer()
-    try:
-        with sr.AudioFile(filename) as source:
-            audio = r.record(source)
-        text = r.recognize_google(audio)
-        logging.info("Recognized: %s", text)
-        print("-> (speech->text):", text)
+# ---- speech recognition ----
+# Backends are tried in RECOGNIZER_CHAIN order: when one is unavailable
+# (offline, package or model missing) the next one gets the same audio. Each
+# backend is built once and keeps its sr.Recognizer warm.
+RECOGNIZER_CHAIN = [n.strip() for n in os.environ.get("LEXCHAT_RECOGNIZER", "google,vosk,sphinx").split(",") if n.strip()]
+VOSK_MODEL_DIR = os.environ.get("LEXCHAT_VOSK_MODEL", "lexchat_env/vosk-model-small-en-us-0.15")
+RECOGNIZER_FIXTURE_FILE = "lexchat_env/recognizer_fixtures.json"   # {"<sha1 of pcm>": "text", "*": "text", "script": [...]}
+
+
+class RecognizerUnavailable(Exception):
+    pass
+
+
+class RecognizerBackend(abc.ABC):
+    name = "base"
+    offline = False     # offline backends can spot the wake word (see WakeListener)
+
+    def __init__(self):
+        self.latencies_ms = collections.deque(maxlen=METRICS_WINDOW)
+        self.failures = 0
+        self._recognizer = None
+
+    def recognizer(self):
+        if self._recognizer is None:
+            self._recognizer = lazy_import("speech_recognition").Recognizer()
+        return self._recognizer
+
+    def warm(self):
+        self.recognizer()
+
+    @abc.abstractmethod
+    def transcribe(self, audio):
+        # -> text; raises sr.UnknownValueError when nothing intelligible was said
+        ...
+
+    def available(self):
+        return True
+
+    def spot(self, audio):
+        # -> seconds into the audio where a leading wake phrase ends, or None
+        raise RecognizerUnavailable(f"{self.name} can't spot the wake word")
+
+    def recognize(self, audio):
+        start = time.perf_counter()
+        try:
+            return self.transcribe(audio)
+        except RecognizerUnavailable:
+            self.failures += 1
+            raise
+        finally:
+            self.latencies_ms.append((time.perf_counter() - start) * 1000)
+
+    def report(self):
+        values = sorted(self.latencies_ms)
+        return {"count": len(values), "failures": self.failures,
+                **{f"p{p}": round(percentile(values, p), 1) if values else None for p in (50, 95)}}
+
+
+class GoogleRecognizer(RecognizerBackend):
+    name = "google"
+
+    def transcribe(self, audio):
+        sr = lazy_import("speech_recognition")
+        try:
+            return self.recognizer().recognize_google(audio)
+        except sr.RequestError as e:
+            raise RecognizerUnavailable(str(e))
+
+
+class SphinxRecognizer(RecognizerBackend):
+    # offline, with the small English model that ships with pocketsphinx
+    name = "sphinx"
+    offline = True
+
+    def available(self):
+        try:
+            importlib.import_module("pocketsphinx")
+        except ImportError:
+            return False
+        return True
+
+    def transcribe(self, audio):
+        sr = lazy_import("speech_recognition")
+        try:
+            return self.recognizer().recognize_sphinx(audio)
+        except sr.RequestError as e:
+            raise RecognizerUnavailable(str(e))
+
+    def spot(self, audio):
+        # keyword spotting: the decoder only listens for the wake phrases
+        sr = lazy_import("speech_recognition")
+        try:
+            decoder = self.recognizer().recognize_sphinx(
+                audio, keyword_entries=[(p, WAKE_SENSITIVITY) for p in WAKE_PHRASES], show_all=True)
+        except sr.RequestError as e:
+            raise RecognizerUnavailable(str(e))
+        # segments are timed in 10 ms decoder frames
+        return wake_phrase_end([(seg.word, seg.end_frame / 100) for seg in decoder.seg()])
+
+
+class VoskRecognizer(RecognizerBackend):
+    # offline; needs the vosk package and a model unpacked at VOSK_MODEL_DIR
+    name = "vosk"
+    offline = True
+
+    def __init__(self, model_dir=VOSK_MODEL_DIR):
+        super().__init__()
+        self.model_dir = model_dir
+        self._model = None
+
+    def model(self):
+        if self._model is None:
+            if not os.path.isdir(self.model_dir):
+                raise RecognizerUnavailable(f"no Vosk model at {self.model_dir}")
+            try:
+                vosk = importlib.import_module("vosk")
+            except ImportError:
+                raise RecognizerUnavailable("vosk is not installed (pip install vosk)")
+            vosk.SetLogLevel(-1)
+            self._model = vosk.Model(self.model_dir)
+        return self._model
+
+    def warm(self):
+        with contextlib.suppress(RecognizerUnavailable):
+            self.model()
+
+    def available(self):
+        try:
+            self.model()
+        except RecognizerUnavailable:
+            return False
+        return True
+
+    def transcribe(self, audio):
+        model = self.model()
+        rec = importlib.import_module("vosk").KaldiRecognizer(model, AUDIO_SAMPLE_RATE)
+        rec.AcceptWaveform(audio.get_raw_data(convert_rate=AUDIO_SAMPLE_RATE, convert_width=2))
+        text = json.loads(rec.FinalResult()).get("text", "")
+        if not text:
+            raise lazy_import("speech_recognition").UnknownValueError()
+        return text
+
+    def spot(self, audio):
+        # a grammar of just the wake phrases; everything else decodes as [unk]
+        model = self.model()
+        grammar = json.dumps(sorted({w for p in WAKE_PHRASES for w in p.split()}) + ["[unk]"])
+        rec = importlib.import_module("vosk").KaldiRecognizer(model, AUDIO_SAMPLE_RATE, grammar)
+        rec.SetWords(True)
+        rec.AcceptWaveform(audio.get_raw_data(convert_rate=AUDIO_SAMPLE_RATE, convert_width=2))
+        words = json.loads(rec.FinalResult()).get("result", [])
+        return wake_phrase_end([(w["word"], w["end"]) for w in words])
+
+
+class FixtureRecognizer(RecognizerBackend):
+    # Deterministic transcripts for tests: looked up by the sha1 of the
+    # audio's PCM, then taken in order from "script", then "*". As a wake
+    # spotter it places the end of the wake phrase in proportion to its text.
+    name = "fixture"
+    offline = True
+
+    def __init__(self, fixtures=None, script=None):
+        super().__init__()
+        if fixtures is None:
+            fixtures = {}
+            if os.path.exists(RECOGNIZER_FIXTURE_FILE):
+                with open(RECOGNIZER_FIXTURE_FILE, "r", encoding="utf-8") as f:
+                    fixtures = json.load(f)
+        self.script = collections.deque(script if script is not None else fixtures.pop("script", []))
+        self.fixtures = fixtures
+
+    def warm(self):
+        pass
+
+    def transcribe(self, audio):
+        text = self.fixtures.get(hashlib.sha1(audio.get_raw_data()).hexdigest())
+        if text is None:
+            text = self.script.popleft() if self.script else self.fixtures.get("*")
+        if not text:
+            raise lazy_import("speech_recognition").UnknownValueError()
+        return text
+
+    def spot(self, audio):
+        try:
+            text = self.transcribe(audio).lower()
+        except lazy_import("speech_recognition").UnknownValueError:
+            return None
+        m = _WAKE_PATTERN.match(text)
+        if not m:
+            return None
+        seconds = len(audio.get_raw_data()) / (2 * audio.sample_rate)
+        return seconds * m.start(1) / len(text)
+
+
+RECOGNIZER_BACKENDS = {cls.name: cls for cls in (GoogleRecognizer, SphinxRecognizer, VoskRecognizer, FixtureRecognizer)}
+_RECOGNIZERS = {}
+
+def get_recognizer(name):
+    backend = _RECOGNIZERS.get(name)
+    if backend is None:
+        backend = _RECOGNIZERS[name] = RECOGNIZER_BACKENDS[name]()
+    return backend
+
+def recognizer_chain():
+    names = [n for n in RECOGNIZER_CHAIN if n in RECOGNIZER_BACKENDS] or ["google"]
+    return [get_recognizer(n) for n in names]
+
+def wake_spotter():
+    # -> the first offline backend that can run, or None; the audio searched
+    # for the wake word never leaves the machine
+    names = [n for n in RECOGNIZER_CHAIN if n in RECOGNIZER_BACKENDS] + list(WAKE_SPOTTERS)
+    for name in dict.fromkeys(names):
+        backend = get_recognizer(name)
+        if backend.offline and backend.available():
+            return backend
+    return None
+
+def warm_recognizers():
+    # build the recognizers (and load any offline model) off the main thread
+    def run():
+        for backend in recognizer_chain():
+            try:
+                backend.warm()
+            except Exception as e:
+                logging.warning("could not warm %s recognizer: %s", backend.name, e)
+    threading.Thread(target=run, name="recognizer-warm", daemon=True).start()
+
+def transcribe_audio(audio):
+    # -> lowercase text, or "" when nothing intelligible was said; raises
+    # RecognizerUnavailable when no backend in the chain could run
+    sr = lazy_import("speech_recognition")
+    for backend in recognizer_chain():
+        try:
+            text = backend.recognize(audio)
+        except sr.UnknownValueError:
+            return ""
+        except RecognizerUnavailable as e:
+            logging.warning("%s recognizer unavailable: %s", backend.name, e)
+            continue
+        logging.info("Recognized (%s): %s", backend.name, text)
         return text.lower()
-    except sr.UnknownValueError:
-        respond(ENGINE, "I couldn't understand that audio.", pause=0.1)
-        return ""
-    except sr.RequestError:
+    raise RecognizerUnavailable("no speech recognizer could run")
+
+@timed("recognize")
+def recognize_audio(audio):
+    try:
+        text = transcribe_audio(audio)
+    except RecognizerUnavailable:
         respond(ENGINE, "Speech service unavailable.", pause=0.1)
         return ""
+    except Exception as e:
+        logging.error("recognize_audio error: %s", e)
+        return ""
+    if not text:
+        respond(ENGINE, "I couldn't understand that audio.", pause=0.1)
+        return ""
+    print("-> (speech->text):", text)
+    return text
+
+def recognize_file(filename):
+    sr = lazy_import("speech_recognition")
+    try:
+        with sr.AudioFile(filename) as source:
+            audio = recognizer_chain()[0].recognizer().record(source)
     except Exception as e:
         logging.error("recognize_file error: %s", e)
         return ""
+    return recognize_audio(audio)
+
+def show_recognizer_stats():
+    print(f"{'backend':<9} {'calls':>6} {'failures':>9} {'p50 ms':>8} {'p95 ms':>8}")
+    for backend in recognizer_chain():
+        r = backend.report()
+        p50 = f"{r['p50']:.1f}" if r["p50"] is not None else "-"
+        p95 = f"{r['p95']:.1f}" if r["p95"] is not None else "-"
+        print(f"{backend.name:<9} {r['count']:>6} {r['failures']:>9} {p50:>8} {p95:>8}")
+
+
+# ---- hands-free listening ----
+# A capture thread (or a WAV fixture) keeps writing into a preallocated ring
+# buffer. The listener walks the ring frame by frame with the endpointer; each
+# finished speech segment is sliced out with pre-roll and an offline spotter
+# looks for the wake word at its start. Only the audio after the wake word is
+# transcribed by the recognizer chain and becomes the command; a bare wake
+# word makes the next segment the command, so no prompt is needed.
+WAKE_WORD = "lexchat"
+WAKE_PHRASES = ("lexchat", "lex chat", "hey lex chat", "ok lex chat", "okay lex chat")
+WAKE_SPOTTERS = ("vosk", "sphinx")
+WAKE_SENSITIVITY = 0.8        # pocketsphinx keyword threshold, 0..1
+WAKE_MIN_COMMAND = 0.2        # seconds after the wake word worth transcribing
+WAKE_RING_SECONDS = 30.0
+WAKE_PREROLL = 0.5            # audio kept from before a segment's speech onset
+WAKE_FOLLOWUP_SECONDS = 6.0   # how long a bare "lexchat" waits for the command
+WAKE_ANSWER_SECONDS = 15.0    # how long ask_input waits for a hands-free answer
+_WAKE_PATTERN = re.compile(r"^\W*(?:(?:hey|ok|okay)\s+)?lex[\s-]?chat\b\W*(.*)$")
+
+
+class AudioRing:
+    # Fixed-size int16 ring. write() copies into the preallocated buffer, so
+    # the capture callback never allocates; positions are absolute sample
+    # counts, and reads older than the ring's capacity are clamped.
+    def __init__(self, seconds=WAKE_RING_SECONDS, rate=AUDIO_SAMPLE_RATE):
+        np = lazy_import("numpy")
+        self.rate = rate
+        self.size = int(seconds * rate)
+        self.buf = np.zeros(self.size, dtype=np.int16)
+        self.written = 0
+        self.closed = False
+        self._cond = threading.Condition()
+
+    def write(self, samples):
+        n = len(samples)
+        if n > self.size:
+            samples, n = samples[-self.size:], self.size
+        start = self.written % self.size
+        first = min(n, self.size - start)
+        self.buf[start:start + first] = samples[:first]
+        if first < n:
+            self.buf[:n - first] = samples[first:]
+        with self._cond:
+            self.written += n
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def wait_for(self, position, timeout=None):
+        # True once `position` samples have been written
+        with self._cond:
+            return self._cond.wait_for(lambda: self.written >= position or self.closed, timeout) \
+                and self.written >= position
+
+    def read_into(self, start, out):
+        start = max(start, self.written - self.size)
+        begin = start % self.size
+        first = min(len(out), self.size - begin)
+        out[:first] = self.buf[begin:begin + first]
+        if first < len(out):
+            out[first:] = self.buf[:len(out) - first]
+        return out
+
+    def read(self, start, end):
+        np = lazy_import("numpy")
+        start = max(start, self.written - self.size)
+        return self.read_into(start, np.empty(max(0, end - start), dtype=np.int16))
+
+
+class MicrophoneSource:
+    def __init__(self, rate=AUDIO_SAMPLE_RATE):
+        self.sd = lazy_import("sounddevice")
+        self.rate = _input_rate(self.sd, rate, "int16")
+        self._stream = None
+
+    def start(self, ring):
+        def callback(indata, frames, when, status):
+            ring.write(indata[:, 0])
+        self._stream = self.sd.InputStream(samplerate=self.rate, channels=AUDIO_CHANNELS, dtype="int16",
+                                           blocksize=int(self.rate * VAD_FRAME_MS / 1000), callback=callback)
+        self._stream.start()
+
+    def stop(self):
+        if self._stream is not None:
+            self._stream.stop()
+            self._stream.close()
+            self._stream = None
+
+
+class WavSource:
+    # replays a 16-bit WAV fixture into the ring as fast as it is consumed;
+    # realtime=True paces it like a live microphone
+    def __init__(self, path, realtime=False):
+        import wave
+        np = lazy_import("numpy")
+        with wave.open(path, "rb") as w:
+            if w.getsampwidth() != 2:
+                raise ValueError(f"{path}: expected 16-bit PCM")
+            self.rate = w.getframerate()
+            data = np.frombuffer(w.readframes(w.getnframes()), dtype=np.int16)
+            if w.getnchannels() > 1:
+                data = data[::w.getnchannels()]
+        self.samples = data
+        self.realtime = realtime
+        self.seconds = len(data) / self.rate
+        self._stop = threading.Event()
+
+    def start(self, ring):
+        chunk = int(self.rate * VAD_FRAME_MS / 1000)
+        def run():
+            for i in range(0, len(self.samples), chunk):
+                if self._stop.is_set():
+                    break
+                ring.write(self.samples[i:i + chunk])
+                if self.realtime:
+                    time.sleep(chunk / self.rate)
+            ring.close()
+        threading.Thread(target=run, name="wav-source", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
 
+def strip_wake_word(text):
+    # -> (heard the wake word, the rest of the utterance)
+    m = _WAKE_PATTERN.match(text or "")
+    return (True, m.group(1).strip()) if m else (False, (text or "").strip())
 
+def wake_phrase_end(words):
+    # [(word, end seconds)] from a spotter -> where a leading wake phrase ends, or None
+    words = [(w.lower(), end) for w, end in words if w != "[unk]"]
+    for i in range(len(words)):
+        m = _WAKE_PATTERN.match(" ".join(w for w, _ in words[:i + 1]))
+        if m and not m.group(1):
+            return words[i][1]
+    return None
+
+
+class WakeListener:
+    # Commands land in .commands; ask_input() in hands-free mode collects the
+    # next segment through next_answer(). Segments that begin while the
+    # assistant is talking are ignored so it doesn't answer itself.
+    def __init__(self, source=None, is_muted=None, ring_seconds=WAKE_RING_SECONDS, spotter=None):
+        self.source = source
+        self.spotter = spotter
+        self.is_muted = is_muted or (lambda: ENGINE.enabled and ENGINE.busy)
+        self.ring_seconds = ring_seconds
+        self.commands = queue.Queue()
+        self.segments = 0
+        self.ring = None
+        self._answers = queue.Queue()
+        self._want_answer = threading.Event()
+        self._armed_until = -1      # ring position up to which a bare wake word waits
+        self._thread = None
+        self._running = False
+        self.finished = threading.Event()
+
+    def start(self):
+        if self._running:
+            return self
+        self.spotter = self.spotter or wake_spotter()
+        if self.spotter is None:
+            raise RecognizerUnavailable("hands-free mode needs Vosk or pocketsphinx to spot the wake word offline")
+        self.source = self.source or MicrophoneSource()
+        seconds = max(self.ring_seconds, getattr(self.source, "seconds", 0) + 1)
+        self.ring = AudioRing(seconds, self.source.rate)
+        self._running = True
+        self.finished.clear()
+        self._thread = threading.Thread(target=self._run, name="wake-listener", daemon=True)
+        self._thread.start()
+        self.source.start(self.ring)
+        return self
+
+    def stop(self):
+        self._running = False
+        if self.source is not None:
+            self.source.stop()
+        if self.ring is not None:
+            self.ring.close()
+
+    def next_answer(self, timeout=WAKE_ANSWER_SECONDS):
+        self._want_answer.set()
+        try:
+            return self._answers.get(timeout=timeout)
+        except queue.Empty:
+            return ""
+        finally:
+            self._want_answer.clear()
+
+    def _segments(self):
+        # yields (start, end, muted) sample positions of speech segments
+        np = lazy_import("numpy")
+        rate = self.ring.rate
+        frame = np.empty(int(rate * VAD_FRAME_MS / 1000), dtype=np.int16)
+        preroll = int(WAKE_PREROLL * rate)
+        pos = self.ring.written
+        ep, floor, onset, muted = None, None, None, False
+        while self._running:
+            if ep is None:
+                ep = Endpointer(rate)
+                if floor is not None:
+                    ep.noise_floor = floor
+                onset = None
+            if not self.ring.wait_for(pos + len(frame), timeout=0.5):
+                if self.ring.closed:
+                    if onset is not None:
+                        yield max(0, onset - preroll), pos, muted
+                    return
+                continue
+            state = ep.feed(self.ring.read_into(pos, frame))
+            pos += len(frame)
+            if state == "speech" and onset is None:
+                onset = pos - len(frame)
+                muted = self.is_muted()
+            if state in ("done", "max"):
+                yield max(0, onset - preroll), pos, muted
+            if state in ("done", "max", "timeout"):
+                floor, ep = ep.noise_floor, None
+
+    def _run(self):
+        try:
+            for start, end, muted in self._segments():
+                self.segments += 1
+                if muted:
+                    continue
+                samples = resample(self.ring.read(start, end), self.ring.rate, AUDIO_SAMPLE_RATE)
+                # answers and the segment after a bare wake word are meant for
+                # us; anything else is only sent on if it starts with the wake word
+                addressed = self._want_answer.is_set() or start < self._armed_until
+                try:
+                    if not addressed:
+                        cut = self.spotter.spot(to_audio_data(samples, AUDIO_SAMPLE_RATE))
+                        if cut is None:
+                            continue
+                        samples = samples[int(cut * AUDIO_SAMPLE_RATE):]
+                    text = ""
+                    if len(samples) >= WAKE_MIN_COMMAND * AUDIO_SAMPLE_RATE:
+                        text = transcribe_audio(to_audio_data(samples, AUDIO_SAMPLE_RATE))
+                except Exception as e:
+                    logging.warning("hands-free recognition failed: %s", e)
+                    continue
+                self._heard(strip_wake_word(text)[1], addressed, end)
+        finally:
+            self._running = False
+            self.finished.set()
+
+    def _heard(self, text, addressed, end):
+        # follow-up windows are measured in ring samples, so a replayed
+        # fixture behaves like the live microphone
+        logging.info("hands-free heard %r (after the wake word: %s)", text, not addressed)
+        if self._want_answer.is_set():
+            if text:
+                self._answers.put(text)
+        elif text:
+            self._armed_until = -1
+            self.commands.put(text)
+        elif not addressed:
+            self._armed_until = end + int(WAKE_FOLLOWUP_SECONDS * self.ring.rate)
+
+WAKE_LISTENER = None
+
+def wake_commands_from_wav(path, spotter=None):
+    # replays a WAV fixture through the hands-free pipeline; -> the commands heard
+    listener = WakeListener(WavSource(path), is_muted=lambda: False, spotter=spotter).start()
+    listener.finished.wait()
+    commands = []
+    while not listener.commands.empty():
+        commands.append(listener.commands.get())
+    return commands
+
+
+# ---- spoken numbers ----
+# All tables are built once at import; parse_number only does dict lookups.
+_UNITS = {w: i for i, w in enumerate(
+    "zero one two three four five six seven eight nine ten eleven twelve thirteen "
+    "fourteen fifteen sixteen seventeen eighteen nineteen".split())}
+_TENS = {w: 10 * i for i, w in enumerate("twenty thirty forty fifty sixty seventy eighty ninety".split(), 2)}
+_SCALES = {"thousand": 10 ** 3, "million": 10 ** 6, "billion": 10 ** 9, "trillion": 10 ** 12}
+_ORDINALS = {
+    "first": 1, "second": 2, "third": 3, "fourth": 4, "fifth": 5, "sixth": 6, "seventh": 7,
+    "eighth": 8, "ninth": 9, "tenth": 10, "eleventh": 11, "twelfth": 12,
+    **{w + "th": v for w, v in _UNITS.items() if 13 <= v <= 19},
+    **{w[:-1] + "ieth": v for w, v in _TENS.items()},
+    "hundredth": 100, **{w + "th": v for w, v in _SCALES.items()},
+}
+_FRACTIONS = {"half": 0.5, "quarter": 0.25}
 _NUMBER_WORDS = {
     **{str(i): i for i in range(0, 21)},
-    "zero":0,"one":1,"two":2,"three":3,"four":4,"five":5,"six":6,"seven":7,"eight":8,"nine":9,
-    "ten":10,"eleven":11,"twelve":12,"thirteen":13,"fourteen":14,"fifteen":15,"sixteen":16,
-    "seventeen":17,"eighteen":18,"nineteen":19,"twenty":20,
-    "thirty":30,"forty":40,"fifty":50,"sixty":60,"seventy":70,"eighty":80,"ninety":90,
-    "hundred":100,"thousand":1000,"million":1000000
+    **_UNITS, **_TENS, "hundred": 100, **_SCALES, **_ORDINALS,
 }
+_NUMBER_TOKEN = re.compile(r"\d+(?:\.\d+)?(?:st|nd|rd|th)?|\.\d+|[a-z]+|[-+]")
+_PLAIN_NUMBER = re.compile(r"\s*[-+]?(?:\d+(?:\.\d*)?|\.\d+)(?:e[-+]?\d+)?\s*")
+_DIGIT_GROUP = re.compile(r"(?<=\d),(?=\d{3}\b)")
+_NEGATIVE = {"minus", "negative", "-"}
+_POSITIVE = {"plus", "positive", "+"}
 
-def parse_number(text):
-    if text is None:
-        return None
-    text = text.strip().lower()
-    # direct numeric
-    try:
-        return float(text)
-    except Exception:
-        pass
-    t = text.replace(",", "")
-    tokens = re.findall(r"[a-z]+|\d+|\-|\.", t)
-    if not tokens:
-        return None
+def _digit_value(tok):
+    tok = re.sub(r"(st|nd|rd|th)$", "", tok)
+    return float(tok) if "." in tok else int(tok)
+
+def _add_small(current, v):
+    # combine a value below 100 with what has been said so far
+    low = current % 100
+    if low == 0:
+        return current + v
+    if low % 10 == 0 and low >= 20 and v < 10:
+        return current + v                # "twenty" "one"
+    if v >= 10:
+        return current * 100 + v          # years: "nineteen" "eighty"
+    return current * 10 + v               # digit by digit: "one" "two"
+
+def _parse_number_tokens(tokens):
+    sign = 1
     total = 0
     current = 0
-    for tok in tokens:
-        if tok.isdigit():
-            current += int(tok)
-        elif tok in _NUMBER_WORDS:
-            val = _NUMBER_WORDS[tok]
-            if val >= 100:
-                if current == 0:
-                    current = 1
-                current *= val
+    seen = False
+    frac = 0
+    i = 0
+    n = len(tokens)
+    while i < n:
+        tok = tokens[i]
+        nxt = tokens[i + 1] if i + 1 < n else None
+        if not seen and tok in _NEGATIVE:
+            sign = -1
+        elif not seen and tok in _POSITIVE:
+            pass
+        elif tok == "and" and seen:
+            pass
+        elif tok in ("a", "an") and (nxt == "hundred" or nxt in _SCALES or nxt in _FRACTIONS):
+            if nxt in _FRACTIONS:
+                frac += _FRACTIONS[nxt]
+                seen = True
+                i += 1
             else:
-                current += val
-        elif tok == "and":
-            continue
-        else:
-            try:
-                current += float(tok)
-            except:
-                pass
-    if current != 0:
-        return float(current)
-    digits = re.search(r"[-+]?\d*\.?\d+", text)
-    if digits:
+                current = current or 1
+        elif tok[0].isdigit() or (tok[0] == "." and len(tok) > 1):
+            v = _digit_value(tok)
+            current = v if not seen or current == 0 else _add_small(current, v)
+            seen = True
+        elif tok in _UNITS or tok in _TENS:
+            current = _add_small(current, _UNITS.get(tok, _TENS.get(tok)))
+            seen = True
+        elif tok in ("hundred", "hundredth"):
+            current = (current or 1) * 100
+            seen = True
+        elif tok in _SCALES or (tok in _ORDINALS and tok[:-2] in _SCALES):
+            scale = _SCALES[tok if tok in _SCALES else tok[:-2]]
+            if current == 0 and total:
+                total *= scale                 # "one thousand thousand"
+            else:
+                total += (current or 1) * scale
+            current = 0
+            seen = True
+        elif tok in _ORDINALS:
+            current = _add_small(current, _ORDINALS[tok])
+            seen = True
+            break                              # an ordinal ends the number
+        elif tok == "point":
+            digits = []
+            while i + 1 < n and (tokens[i + 1] in _UNITS and _UNITS[tokens[i + 1]] < 10 or tokens[i + 1].isdigit()):
+                i += 1
+                digits.append(str(_UNITS.get(tokens[i], tokens[i])))
+            if not digits:
+                break
+            whole = total + current
+            value = float(f"{int(whole)}.{''.join(digits)}") + (whole - int(whole))
+            total, current, seen = 0, value, True
+            if i + 1 < n and tokens[i + 1] in _SCALES:
+                i += 1
+                current *= _SCALES[tokens[i]]
+        elif seen:
+            break                              # the number ended at the first other word
+        i += 1
+    if not seen:
+        return None
+    value = sign * (total + current + frac)
+    return value if not isinstance(value, float) or math.isfinite(value) else None
+
+@functools.lru_cache(maxsize=1024)
+def _parse_number_cached(text):
+    if _PLAIN_NUMBER.fullmatch(text):
+        if not re.search(r"[.e]", text):
+            return int(text)
+        value = float(text)
+        return value if math.isfinite(value) else None   # "1e400" is not a number anyone said
+    t = _DIGIT_GROUP.sub("", text).replace(",", " ")
+    # "twenty-one" but keep a leading minus sign on digits
+    t = re.sub(r"(?<=[a-z])-(?=[a-z])", " ", t)
+    return _parse_number_tokens(_NUMBER_TOKEN.findall(t))
+
+def parse_number(text):
+    # "two thousand three hundred" -> 2300, "minus three point five" -> -3.5,
+    # "twenty first" -> 21, "a hundred" -> 100; words after the number are ignored
+    if text is None:
+        return None
+    return _parse_number_cached(text.strip().lower())
+
+def parse_numbers(texts):
+    # batch form of parse_number: one result (or None) per input string
+    return [None if t is None else _parse_number_cached(t.strip().lower()) for t in texts]
+
+def parse_int(text):
+    # exact integers for number theory: floats lose digits past 2**53
+    ints = re.findall(r"(?<![\d.])[-+]?\d[\d,]*(?![\d,]*\.\d)", text or "")
+    if len(ints) == 1:
+        return int(ints[0].replace(",", ""))
+    val = parse_number(text)
+    return None if val is None else int(val)
+
+
+def normalize_query(query):
+    return " ".join(re.sub(r"[^\w\s]", " ", (query or "").lower()).split())
+
+
+class SearchCache:
+    # On-disk query cache: normalized query + num_results -> results, with a
+    # TTL and least-recently-used eviction once SEARCH_CACHE_MAX entries are held.
+    def __init__(self, path, ttl=None, max_entries=None):
+        self.path = path
+        self.ttl = SEARCH_CACHE_TTL if ttl is None else ttl
+        self.max_entries = SEARCH_CACHE_MAX if max_entries is None else max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(query, num_results):
+        return f"{normalize_query(query)}|{num_results}"
+
+    def _load(self):
+        if self._entries is None:
+            self._entries = collections.OrderedDict()
+            if os.path.exists(self.path):
+                try:
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        self._entries.update(json.load(f))
+                except Exception as e:
+                    logging.warning("could not load search cache: %s", e)
+        return self._entries
+
+    def _save(self):
         try:
-            return float(digits.group())
-        except:
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self._entries, f)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            logging.warning("could not save search cache: %s", e)
+
+    def get(self, query, num_results):
+        key = self.key(query, num_results)
+        with self._lock:
+            entries = self._load()
+            item = entries.get(key)
+            if item is not None and time.time() - item["time"] > self.ttl:
+                del entries[key]
+                item = None
+            if item is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            entries.move_to_end(key)
+            return item["results"]
+
+    def put(self, query, num_results, results):
+        key = self.key(query, num_results)
+        with self._lock:
+            entries = self._load()
+            entries[key] = {"time": time.time(), "query": query, "results": results}
+            entries.move_to_end(key)
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+            self._save()
+
+    def stats(self):
+        total = self.hits + self.misses
+        size = len(self._load())
+        return {"hits": self.hits, "misses": self.misses, "entries": size,
+                "hit_rate": (self.hits / total) if total else 0.0}
+
+
+SEARCH_CACHE = SearchCache(SEARCH_CACHE_FILE)
+
+class SearchTimeout(Exception):
+    pass
+
+
+_CJK = re.compile("[\u4e00-\u9fff]")
+
+class SearchBackend(abc.ABC):
+    # A provider only has to implement results(query), a (possibly slow)
+    # iterator of raw {"title","href","body"} dicts. search() runs it on a
+    # worker thread and yields cleaned results as they arrive, enforcing the
+    # deadline and honouring the cancel event.
+    name = "base"
+
+    @abc.abstractmethod
+    def results(self, query):
+        ...
+
+    @staticmethod
+    def clean(raw):
+        title = raw.get("title","")
+        link = raw.get("href","") or raw.get("link","")
+        body = raw.get("body","") or raw.get("snippet","")
+        # skip CJK
+        if body and _CJK.search(body):
             return None
-    return None
+        return {"title":title,"link":link,"snippet":body}
 
+    def search(self, query, num_results=5, timeout=None, cancel=None):
+        timeout = SEARCH_TIMEOUT if timeout is None else timeout
+        cancel = cancel or threading.Event()
+        inbox = queue.Queue()
 
-def search_web(query, num_results=5):
-    respond(ENGINE, f"Searching the web for {query} 🔍")
-    results_list = []
-    try:
-       with DDGS() as ddgs:
-            results = ddgs.text(query)
-            count = 0
-            for r in results:
-                title = r.get("title","")
-                link = r.get("href","")
-                body = r.get("body","")
-                # skip CJK
-                if any('\u4e00' <= ch <= '\u9fff' for ch in (body or "")):
+        def worker():
+            try:
+                for raw in self.results(query):
+                    if cancel.is_set():
+                        break
+                    inbox.put(("result", raw))
+            except Exception as e:
+                inbox.put(("error", e))
+            finally:
+                inbox.put(("end", None))
+
+        threading.Thread(target=worker, name=f"search-{self.name}", daemon=True).start()
+        deadline = time.monotonic() + timeout
+        count = 0
+        try:
+            while count < num_results and not cancel.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise SearchTimeout(f"{self.name} search exceeded {timeout:.1f}s")
+                try:
+                    kind, payload = inbox.get(timeout=min(remaining, 0.1))
+                except queue.Empty:
                     continue
-                results_list.append({"title":title,"link":link,"snippet":body})
-                count += 1
-                if count >= num_results:
-                    break
-    except Exception as e:
-        logging.error("search_web error: %s", e)
-        respond(ENGINE, "Search failed due to an error.")
+                if kind == "end":
+                    return
+                if kind == "error":
+                    raise payload
+                res = self.clean(payload)
+                if res:
+                    count += 1
+                    yield res
+        finally:
+            # tell the worker to stop pulling from the provider
+            cancel.set()
+
+
+class DDGSBackend(SearchBackend):
+    name = "ddgs"
+
+    def results(self, query):
+        DDGS = lazy_import("duckduckgo_search").DDGS
+        with DDGS(timeout=max(1, int(SEARCH_TIMEOUT))) as ddgs:
+            yield from ddgs.text(query)
+
+
+class FixtureBackend(SearchBackend):
+    # Replays canned results offline. Fixtures map a query (or "*" for any
+    # other query) to a list of results, or to {"delay": s, "results": [...]}
+    # where delay is slept before each result to mimic a slow provider.
+    name = "fixture"
+
+    def __init__(self, fixtures=None, delay=0.0):
+        if fixtures is None:
+            fixtures = {}
+            if os.path.exists(SEARCH_FIXTURE_FILE):
+                with open(SEARCH_FIXTURE_FILE, "r", encoding="utf-8") as f:
+                    fixtures = json.load(f)
+        self.fixtures = {q if q == "*" else normalize_query(q): v for q, v in fixtures.items()}
+        self.delay = delay
+
+    def results(self, query):
+        entry = self.fixtures.get(normalize_query(query), self.fixtures.get("*", []))
+        delay = self.delay
+        if isinstance(entry, dict):
+            delay = entry.get("delay", delay)
+            entry = entry.get("results", [])
+        for raw in entry:
+            if delay:
+                time.sleep(delay)
+            yield raw
+
+
+SEARCH_BACKENDS = {"ddgs": DDGSBackend, "fixture": FixtureBackend}
+_backend = None
+
+def get_search_backend():
+    global _backend
+    if _backend is None or _backend.name != SEARCH_BACKEND:
+        _backend = SEARCH_BACKENDS[SEARCH_BACKEND]()
+    return _backend
+
+def fetch_results(query, num_results=5, timeout=None):
+    return list(get_search_backend().search(query, num_results, timeout=timeout))
+
+def print_result(res):
+    snippet = res.get("snippet") or ""
+    print("\n📰", res.get("title") or "Untitled result")
+    print("🔗", res.get("link") or "")
+    print("📄", (snippet[:300] + "...") if len(snippet) > 300 else snippet)
+
+def present_result(res):
+    title = res.get("title") or "Untitled result"
+    snippet = res.get("snippet") or ""
+    print_result(res)
+    respond(ENGINE, title, pause=0.28, priority=SPEECH_LOW)
+    if snippet:
+        respond(ENGINE, (snippet[:220] + ("..." if len(snippet) > 220 else "")), pause=0.18, priority=SPEECH_LOW)
+
+@timed("search")
+def search_web(query, num_results=5, refresh=False, timeout=None, cancel=None):
+    results_list = None if refresh else SEARCH_CACHE.get(query, num_results)
+    cached = results_list is not None
+    if cached:
+        respond(ENGINE, f"Here's what I found for {query} ⚡")
+        for res in results_list:
+            present_result(res)
+    else:
+        respond(ENGINE, f"Searching the web for {query} 🔍")
+        # while the provider works, show what earlier searches already found
+        preview = local_index().search(query, LOCAL_PREVIEW, require_all=True, wait=False)
+        if preview:
+            print("\n⚡ From earlier searches:")
+            for _, res in preview:
+                print("  •", res.get("title") or "Untitled result", "—", res.get("link") or "")
+            respond(ENGINE, f"From earlier searches: {preview[0][1].get('title') or 'an untitled page'}.", priority=SPEECH_LOW)
+        results_list = []
+        complete = False
+        try:
+            # print and speak each result the moment the backend hands it over;
+            # server sessions fetch on the I/O pool and present the batch
+            if _SESSION.get() is not None:
+                found = offload("io", fetch_results, query, num_results, timeout)
+            else:
+                found = get_search_backend().search(query, num_results, timeout=timeout, cancel=cancel)
+            for res in found:
+                results_list.append(res)
+                present_result(res)
+            complete = not (cancel and cancel.is_set())
+        except KeyboardInterrupt:
+            respond(ENGINE, "Search cancelled.", priority=SPEECH_URGENT)
+        except SearchTimeout as e:
+            logging.warning("search_web timeout: %s", e)
+            respond(ENGINE, "The search provider is taking too long, so I stopped waiting.")
+        except Exception as e:
+            logging.error("search_web error: %s", e)
+            respond(ENGINE, "Search failed due to an error.")
+            return
+        if complete:
+            SEARCH_CACHE.put(query, num_results, results_list)
+        elif not results_list:
+            return
+    local_index().add(results_list, query)
+    save_last_search(results_list)
+    respond(ENGINE, "Search results complete.", priority=SPEECH_LOW)
+    save_history({"type":"search","query":query,"cached":cached,"time":now_str()})
+
+def save_last_search(results):
+    if _SESSION.get() is not None:
+        _SESSION.get().last_search = results
         return
-    # save
     try:
         with open(LAST_SEARCH_FILE, "w", encoding="utf-8") as f:
-            json.dump(results_list, f, indent=2)
+            json.dump(results, f, indent=2)
     except Exception as e:
         logging.warning("could not save last search: %s", e)
-    # speak short summaries
-    for res in results_list:
-        title = res.get("title") or "Untitled result"
-        snippet = res.get("snippet") or ""
-        link = res.get("link") or ""
-        print("\n📰", title)
-        print("🔗", link)
-        print("📄", (snippet[:300] + "...") if len(snippet) > 300 else snippet)
-        respond(ENGINE, title, pause=0.28)
-        if snippet:
-            respond(ENGINE, (snippet[:220] + ("..." if len(snippet) > 220 else "")), pause=0.18)
-    respond(ENGINE, "Search results complete.")
-    save_history({"type":"search","query":query,"time":now_str()})
+
+
+# ---- multi-query search ----
+# "search python asyncio; numpy broadcasting" fetches every query at once on
+# a bounded pool, then merges the lists by reciprocal-rank fusion: a result's
+# score is the sum of 1/(k + rank) over the queries that returned it, so
+# results several queries agree on rise. The same page (by normalized URL)
+# or a near-identical snippet is kept once.
+SEARCH_FANOUT_WORKERS = 4        # queries fetched at the same time
+SEARCH_FANOUT_RESULTS = 8        # merged results shown
+SEARCH_DUP_SIMILARITY = 0.8      # snippet word overlap (Jaccard) that counts as the same result
+SEARCH_DUP_MIN_WORDS = 5         # shorter snippets are only compared by URL
+SEARCH_RRF_K = 60
+_TRACKING_PARAM = re.compile(r"^(?:utm_\w+|ref|ref_src|fbclid|gclid|mc_cid|mc_eid)$")
+_fanout_pool = None
+
+def split_queries(text):
+    return list(dict.fromkeys(q.strip() for q in re.split(r"[;|\n]+", text or "") if q.strip()))
+
+def normalize_url(link):
+    # scheme, "www.", fragment, tracking parameters and a trailing slash
+    # don't make a different page
+    from urllib.parse import urlsplit, parse_qsl, urlencode
+    parts = urlsplit((link or "").strip())
+    host = parts.netloc.lower()
+    host = host[4:] if host.startswith("www.") else host
+    params = urlencode(sorted((k, v) for k, v in parse_qsl(parts.query) if not _TRACKING_PARAM.match(k)))
+    return f"{host}{parts.path.rstrip('/')}" + (f"?{params}" if params else "")
+
+def merge_results(result_lists, limit=SEARCH_FANOUT_RESULTS):
+    # [(query, [result, ...]), ...] -> (ranked results, duplicates dropped);
+    # each result gains "queries" (who returned it) and "score"
+    merged = []          # [score, result, queries, snippet words]
+    by_url = {}
+    dropped = 0
+    for query, results in result_lists:
+        for rank, res in enumerate(results):
+            score = 1.0 / (SEARCH_RRF_K + rank + 1)
+            url = normalize_url(res.get("link"))
+            words = set(normalize_query(res.get("snippet")).split())
+            item = by_url.get(url) if url else None
+            if item is None and len(words) >= SEARCH_DUP_MIN_WORDS:
+                for other in merged:
+                    if other[3] and len(words & other[3]) >= SEARCH_DUP_SIMILARITY * len(words | other[3]):
+                        item = other
+                        break
+            if item is not None:
+                dropped += 1
+                item[0] += score
+                if query not in item[2]:
+                    item[2].append(query)
+            else:
+                item = [score, res, [query], words if len(words) >= SEARCH_DUP_MIN_WORDS else None]
+                merged.append(item)
+            if url:
+                by_url.setdefault(url, item)
+    merged.sort(key=lambda m: -m[0])    # stable: ties keep provider order
+    return [dict(m[1], queries=m[2], score=round(m[0], 5)) for m in merged[:limit]], dropped
+
+def _fetch_one(query, num_results, refresh, timeout, index):
+    # -> (query, results, error); complete result sets go into the cache
+    cached = None if refresh else SEARCH_CACHE.get(query, num_results)
+    if cached is not None:
+        return query, cached, None
+    try:
+        results = fetch_results(query, num_results, timeout)
+    except Exception as e:
+        logging.warning("search %r failed: %s", query, e)
+        return query, [], e
+    SEARCH_CACHE.put(query, num_results, results)
+    index.add(results, query)
+    return query, results, None
+
+def fanout_pool():
+    global _fanout_pool
+    if _SESSION.get() is not None and "io" in _POOLS:
+        return _POOLS["io"]
+    if _fanout_pool is None:
+        cf = importlib.import_module("concurrent.futures")
+        _fanout_pool = cf.ThreadPoolExecutor(SEARCH_FANOUT_WORKERS, thread_name_prefix="search-fanout")
+    return _fanout_pool
+
+# ---- local search ----
+# Every fetched result lands in an append-only JSONL corpus and an in-memory
+# inverted index (term -> {doc id: term frequency}) that add() updates in
+# place; a page fetched again replaces its older copy. "local search" ranks
+# the corpus with BM25 and never touches the network.
+LOCAL_CORPUS_FILE = "lexchat_env/search_corpus.jsonl"
+LOCAL_RESULTS = 8
+LOCAL_PREVIEW = 3             # earlier results shown while a live search runs
+LOCAL_TITLE_WEIGHT = 2        # title words count this many times
+BM25_K1 = 1.2
+BM25_B = 0.75
+_STOPWORDS = frozenset("a an and are as at be by for from how i in is it of on or the to what with".split())
+_INDEX_WORD = re.compile(r"[^\W_]+")
+
+def index_terms(text):
+    return [w for w in _INDEX_WORD.findall((text or "").lower()) if w not in _STOPWORDS]
+
+
+class LocalIndex:
+    # path=None keeps the index in memory only (server sessions)
+    def __init__(self, path):
+        self.path = path
+        self.docs = {}          # id -> {"title", "link", "snippet", "query", "time", "key"}
+        self.lengths = {}       # id -> weighted term count
+        self.postings = {}      # term -> {id: term frequency}
+        self.by_key = {}        # normalized url -> id
+        self.total_length = 0
+        self._ids = itertools.count()
+        self._loaded = not (path and os.path.exists(path))   # nothing on disk to replay
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    def _load(self):
+        # Replays the corpus into a staging index without holding _lock, so
+        # adds and non-waiting searches carry on meanwhile, then swaps it in
+        # with the pages added since. Rewrites the corpus once replaced copies
+        # dominate.
+        if self._loaded:
+            return
+        with self._load_lock:
+            if self._loaded:
+                return
+            staged = LocalIndex(None)
+            lines = 0
+            if self.path and os.path.exists(self.path):
+                try:
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        for line in f:
+                            lines += 1
+                            try:
+                                staged._add(json.loads(line))
+                            except (ValueError, AttributeError):
+                                continue
+                except OSError as e:
+                    logging.warning("could not load the local search corpus: %s", e)
+            with self._lock:
+                for doc in self.docs.values():
+                    staged._add(doc)
+                self.docs, self.lengths, self.postings, self.by_key = staged.docs, staged.lengths, staged.postings, staged.by_key
+                self.total_length, self._ids = staged.total_length, staged._ids
+                self._loaded = True
+                if lines > 2 * len(self.docs) + 100:
+                    try:
+                        tmp = self.path + ".tmp"
+                        with open(tmp, "w", encoding="utf-8") as f:
+                            f.writelines(json.dumps(d, ensure_ascii=False) + "\n" for d in self.docs.values())
+                        os.replace(tmp, self.path)
+                    except OSError as e:
+                        logging.warning("could not compact the local search corpus: %s", e)
+
+    @staticmethod
+    def _terms(doc):
+        terms = collections.Counter(index_terms(doc.get("title")) * LOCAL_TITLE_WEIGHT)
+        terms.update(index_terms(doc.get("snippet")))
+        return terms
+
+    def _add(self, doc):
+        # -> True when the page is new or its text changed
+        key = doc.get("key") or normalize_url(doc.get("link")) or doc.get("title")
+        if not key:
+            return False
+        doc["key"] = key       # stored, so reloading the corpus skips URL parsing
+        old = self.by_key.get(key)
+        if old is not None:
+            prev = self.docs[old]
+            if prev.get("title") == doc.get("title") and prev.get("snippet") == doc.get("snippet"):
+                return False
+            self._remove(old)
+        doc_id = next(self._ids)
+        terms = self._terms(doc)
+        for term, tf in terms.items():
+            self.postings.setdefault(term, {})[doc_id] = tf
+        self.docs[doc_id] = doc
+        self.lengths[doc_id] = sum(terms.values())
+        self.total_length += self.lengths[doc_id]
+        self.by_key[key] = doc_id
+        return True
+
+    def _remove(self, doc_id):
+        doc = self.docs.pop(doc_id)
+        for term in self._terms(doc):
+            posting = self.postings.get(term)
+            if posting is not None:
+                posting.pop(doc_id, None)
+                if not posting:
+                    del self.postings[term]
+        self.total_length -= self.lengths.pop(doc_id)
+
+    def add(self, results, query=None):
+        # index a fetched result set; new or changed pages are appended to the
+        # corpus (a load still in progress picks them up when it swaps in)
+        with self._lock:
+            fresh = []
+            for res in results or ():
+                doc = {"title": res.get("title") or "", "link": res.get("link") or "",
+                       "snippet": res.get("snippet") or "", "query": query, "time": now_str()}
+                if self._add(doc):
+                    fresh.append(doc)
+            if fresh and self.path:
+                try:
+                    with open(self.path, "a", encoding="utf-8") as f:
+                        f.writelines(json.dumps(d, ensure_ascii=False) + "\n" for d in fresh)
+                except OSError as e:
+                    logging.warning("could not save to the local search corpus: %s", e)
+        return len(fresh)
+
+    def search(self, text, limit=LOCAL_RESULTS, require_all=False, wait=True):
+        # -> [(BM25 score, result)], best first; require_all keeps only pages
+        # containing every term; wait=False doesn't wait for the corpus to
+        # load and searches only what is in memory so far
+        terms = list(dict.fromkeys(index_terms(text)))
+        if wait:
+            self._load()
+        with self._lock:
+            n = len(self.docs)
+            if not n or not terms or not self.total_length:
+                return []
+            postings = [self.postings.get(term) for term in terms]
+            if require_all:
+                if not all(postings):
+                    return []
+                # score only the pages in every posting list, smallest list first
+                keep = set(min(postings, key=len))
+                for posting in postings:
+                    keep.intersection_update(posting)
+            # tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / avgdl)), idf-weighted
+            base = BM25_K1 * (1 - BM25_B)
+            scale = BM25_K1 * BM25_B * n / self.total_length
+            lengths = self.lengths
+            scores = {}
+            for posting in postings:
+                if not posting:
+                    continue
+                idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5)) * (BM25_K1 + 1)
+                docs = posting.items() if not require_all else ((d, posting[d]) for d in keep)
+                for doc_id, tf in docs:
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf / (tf + base + scale * lengths[doc_id])
+            best = heapq.nlargest(limit, scores.items(), key=lambda kv: kv[1])
+            return [(sc, self.docs[d]) for d, sc in best]
+
+    def count(self):
+        self._load()
+        with self._lock:
+            return len(self.docs)
+
+LOCAL_INDEX = LocalIndex(LOCAL_CORPUS_FILE)
+
+def local_index():
+    # server sessions search only what they fetched themselves
+    session = _SESSION.get()
+    return session.local_index if session is not None else LOCAL_INDEX
+
+@timed("search")
+def search_many(queries, num_results=5, refresh=False, timeout=None):
+    queries = list(dict.fromkeys(queries))
+    respond(ENGINE, f"Searching {len(queries)} topics at once 🔍")
+    # pool threads don't see the session context, so hand them its index
+    index = local_index()
+    outcomes = list(fanout_pool().map(lambda q: _fetch_one(q, num_results, refresh, timeout, index), queries))
+    merged, dropped = merge_results([(q, results) for q, results, _ in outcomes])
+    failed = [q for q, _, error in outcomes if error is not None]
+    if not merged:
+        respond(ENGINE, "None of those searches found anything." if not failed else "Those searches failed.")
+        return merged
+    for res in merged:
+        print_result(res)
+        print("🔎", ", ".join(res["queries"]))
+    found = sum(len(results) for _, results, _ in outcomes)
+    summary = f"{found} results for {len(queries)} searches"
+    if dropped:
+        summary += f", {dropped} of them duplicates"
+    summary += ". Top results: " + "; ".join(r.get("title") or "untitled" for r in merged[:3]) + "."
+    if failed:
+        summary += f" No answer for {', '.join(failed)}."
+    respond(ENGINE, summary)
+    save_last_search(merged)
+    save_history({"type":"search","query":"; ".join(queries),"fanout":len(queries),"time":now_str()})
+    return merged
+
+def show_search_cache_stats():
+    st = SEARCH_CACHE.stats()
+    respond(ENGINE, f"Search cache: {st['hits']} hits, {st['misses']} misses, {st['entries']} saved queries.")
 
 def load_last_search():
-    if os.path.exists(LAST_SEARCH_FILE):
-        with open(LAST_SEARCH_FILE, "r", encoding="utf-8") as f:
-            results = json.load(f)
+    session = _SESSION.get()
+    if session is not None or os.path.exists(LAST_SEARCH_FILE):
+        if session is not None:
+            results = session.last_search
+        else:
+            with open(LAST_SEARCH_FILE, "r", encoding="utf-8") as f:
+                results = json.load(f)
+        if not results:
+            respond(ENGINE, "No previous searches saved.")
+            return
         respond(ENGINE, "Here are your last saved search results:")
         for r in results:
             print("\n📰", r.get("title"))
@@ -249,74 +2338,325 @@ def load_last_search():
         respond(ENGINE, "No previous searches saved.")
 
 
-def draw_flower(petals=6, size=50, color="magenta"):
-    screen = turtle.Screen()
-    t = turtle.Turtle()
-    t.color(color)
-    t.speed(6)
-    for _ in range(petals):
-        t.circle(size)
-        t.left(360 / petals)
-    screen.mainloop()
+# ---- shape geometry ----
+# Every shape is computed as turtle-style vertex paths with NumPy (y up, the
+# pen starting at the origin facing east). The turtle window just replays the
+# paths; SVG/PNG export needs neither Tk nor a display.
+SHAPES_HELP = "square, triangle, circle, star, heart, spiral:n, polygon:n, flower:n"
+SHAPE_MAX_STEPS = 200000
+DRAW_MAX_SIZE = 2000          # spoken sizes are clamped to 1..DRAW_MAX_SIZE
+SPIRAL_STEPS = 60
+DRAWINGS_DIR = "lexchat_env/drawings"
+DRAWING_MARGIN = 10
 
-def draw_shape(shape="square", color="blue", size=100, speed=5):
-    screen = turtle.Screen()
-    t = turtle.Turtle()
-    t.color(color)
-    t.speed(speed)
-    try:
-        if shape == "square":
-            for _ in range(4):
-                t.forward(size)
-                t.right(90)
-        elif shape == "triangle":
-            for _ in range(3):
-                t.forward(size)
-                t.left(120)
-        elif shape == "circle":
-            t.circle(size)
-        elif shape == "star":
-            for _ in range(5):
-                t.forward(size)
-                t.right(144)
-        elif shape == "heart":
+def _walk(turns, lengths, heading=0.0):
+    # turns (degrees, applied before each move) and move lengths -> vertices
+    np = lazy_import("numpy")
+    h = np.radians(heading + np.cumsum(turns, dtype=float))
+    pts = np.zeros((len(h) + 1, 2))
+    pts[1:, 0] = np.cumsum(lengths * np.cos(h))
+    pts[1:, 1] = np.cumsum(lengths * np.sin(h))
+    return pts
+
+def _arc(radius, extent, steps=None):
+    # the (turns, lengths) of turtle.circle(radius, extent); a negative radius turns right
+    np = lazy_import("numpy")
+    steps = steps or max(12, int(abs(extent) / 6) + 1)
+    w = extent / steps * (1 if radius >= 0 else -1)
+    chord = 2 * abs(radius) * math.sin(math.radians(abs(w)) / 2)
+    turns = np.full(steps, w)
+    turns[0] = w / 2
+    return turns, np.full(steps, chord), w / 2   # last value: the turn still owed after the final move
+
+def _regular(n, size, turn):
+    np = lazy_import("numpy")
+    return _walk(np.r_[0.0, np.full(n - 1, turn)], np.full(n, float(size)))
+
+def _shape_arg(shape, default, minimum, label):
+    parts = shape.split(":")
+    if len(parts) == 1:
+        return default
+    if len(parts) != 2 or not parts[1].isdigit():
+        raise ValueError(f"Invalid {label} format. Use {label}:n")
+    n = int(parts[1])
+    if n < minimum:
+        raise ValueError(f"{label.capitalize()} must have at least {minimum} {'sides' if label == 'polygon' else 'steps'}.")
+    if n > SHAPE_MAX_STEPS:
+        raise ValueError(f"{label.capitalize()} is limited to {SHAPE_MAX_STEPS} steps.")
+    return n
+
+@functools.lru_cache(maxsize=128)
+def shape_paths(shape, size=100):
+    # -> (tuple of read-only (N, 2) vertex arrays, filled)
+    np = lazy_import("numpy")
+    shape = shape.strip().lower()
+    name = shape.split(":")[0]
+    filled = False
+    if name == "square":
+        paths = [_regular(4, size, -90)]
+    elif name == "triangle":
+        paths = [_regular(3, size, 120)]
+    elif name == "star":
+        paths = [_regular(5, size, -144)]
+    elif name == "polygon":
+        n = _shape_arg(shape, None, 3, "polygon")
+        if n is None:
+            raise ValueError("Invalid polygon format. Use polygon:n")
+        paths = [_regular(n, size, -360.0 / n)]
+    elif name == "spiral":
+        n = _shape_arg(shape, SPIRAL_STEPS, 2, "spiral")
+        paths = [_walk(np.r_[0.0, np.full(n - 1, -91.0)], np.arange(n) * 3.0)]
+    elif name == "circle":
+        turns, lengths, _ = _arc(size, 360)
+        paths = [_walk(turns, lengths)]
+    elif name == "flower":
+        petals = _shape_arg(shape, 6, 1, "flower")
+        turns, lengths, _ = _arc(size // 2, 360)
+        petal = _walk(turns, lengths)
+        paths = []
+        for a in np.radians(np.arange(petals) * 360.0 / petals):
+            rot = np.array([[math.cos(a), math.sin(a)], [-math.sin(a), math.cos(a)]])
+            paths.append(petal @ rot)
+    elif name == "heart":
+        # left 140, forward, right-hand arc 200, left 120, right-hand arc 200, forward
+        t1, l1, end1 = _arc(-size / 2, 200)
+        t2, l2, end2 = _arc(-size / 2, 200)
+        turns = np.r_[0.0, t1, end1 + 120 + t2[0], t2[1:], end2]
+        lengths = np.r_[float(size), l1, l2, float(size)]
+        paths = [_walk(turns, lengths, heading=140.0)]
+        filled = True
+    else:
+        raise ValueError(f"Shape not recognized. Use {SHAPES_HELP}")
+    for p in paths:
+        p.flags.writeable = False
+    return tuple(paths), filled
+
+def _fit(paths, margin=DRAWING_MARGIN):
+    # shift into positive image coordinates with y pointing down
+    np = lazy_import("numpy")
+    pts = np.concatenate(paths)
+    lo, hi = pts.min(axis=0), pts.max(axis=0)
+    width, height = (hi - lo) + 2 * margin
+    return [np.c_[p[:, 0] - lo[0] + margin, hi[1] - p[:, 1] + margin] for p in paths], max(width, 1), max(height, 1)
+
+@functools.lru_cache(maxsize=64)
+def shape_svg(shape, color="blue", size=100):
+    color = re.sub(r"[^\w#(),.% -]", "", color) or "blue"
+    paths, filled = shape_paths(shape, size)
+    fitted, width, height = _fit(paths)
+    fill = color if filled else "none"
+    body = []
+    for p in fitted:
+        d = "M" + " L".join(f"{x:.2f},{y:.2f}" for x, y in p)
+        body.append(f'  <path d="{d}" fill="{fill}" stroke="{color}" stroke-width="2" stroke-linejoin="round"/>')
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" width="{width:.0f}" height="{height:.0f}" '
+            f'viewBox="0 0 {width:.2f} {height:.2f}">\n' + "\n".join(body) + "\n</svg>\n")
+
+def drawing_path(shape, color, size, ext="svg"):
+    safe = re.sub(r"[^a-z0-9]+", "-", f"{shape}-{color}-{size}".lower()).strip("-")
+    return os.path.join(DRAWINGS_DIR, f"{safe}.{ext}")
+
+def export_drawing(shape, color="blue", size=100, path=None, fmt=None):
+    # writes an .svg (or .png with Pillow) and returns its path; identical
+    # (shape, color, size) requests reuse the file already on disk
+    fmt = (fmt or (os.path.splitext(path)[1].lstrip(".") if path else "svg")).lower()
+    path = path or drawing_path(shape, color, size, fmt)
+    if os.path.exists(path):
+        return path
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    # written under a private name and moved into place, so concurrent
+    # exports of the same drawing never see a half-written file
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    if fmt == "svg":
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(shape_svg(shape, color, size))
+    elif fmt == "png":
+        Image = lazy_import("PIL.Image")
+        ImageDraw = lazy_import("PIL.ImageDraw")
+        paths, filled = shape_paths(shape, size)
+        fitted, width, height = _fit(paths)
+        img = Image.new("RGB", (int(math.ceil(width)), int(math.ceil(height))), "white")
+        pen = ImageDraw.Draw(img)
+        for p in fitted:
+            pts = [tuple(xy) for xy in p.tolist()]
+            if filled:
+                pen.polygon(pts, fill=color, outline=color)
+            else:
+                pen.line(pts, fill=color, width=2, joint="curve")
+        img.save(tmp, format="PNG")
+    else:
+        raise ValueError(f"Unsupported drawing format: {fmt}")
+    os.replace(tmp, path)
+    return path
+
+def has_display():
+    if os.name == "nt" or sys.platform == "darwin":
+        return True
+    return bool(os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY"))
+
+
+# ---- render worker ----
+# Tk is not thread-safe, so a single long-lived process owns the turtle window
+# and the REPL only sends it precomputed paths. Drawing runs with tracer(0) and
+# pushes a frame every 2**speed moves, so even large shapes appear almost at once.
+RENDER_POLL_MS = 30
+
+def _turtle_replay(t, screen, paths, filled, speed):
+    frame = 2 ** max(0, min(int(speed), 12))
+    moves = 0
+    for p in paths:
+        t.penup()
+        t.goto(*p[0])
+        t.pendown()
+        if filled:
             t.begin_fill()
-            t.color(color)
-            t.left(140)
-            t.forward(size)
-            t.circle(-size/2,200)
-            t.left(120)
-            t.circle(-size/2,200)
-            t.forward(size)
+        for x, y in p[1:].tolist():
+            t.goto(x, y)
+            moves += 1
+            if moves % frame == 0:
+                screen.update()
+        if filled:
             t.end_fill()
-        elif shape == "spiral":
-            for i in range(60):
-                t.forward(i * 3)
-                t.right(91)
-        elif shape.startswith("polygon"):
+
+def _render_main(jobs, events):
+    # entry point of the render process; nothing else ever touches Tk
+    try:
+        turtle = importlib.import_module("turtle")
+        screen = turtle.Screen()
+        screen.title("Lexchat")
+        screen.tracer(0)
+    except Exception as e:
+        events.put(("failed", None, f"{type(e).__name__}: {e}"))
+        return
+    def poll():
+        while True:
             try:
-                sides = int(shape.split(":")[1])
-                if sides < 3:
-                    respond(ENGINE, "Polygon must have at least 3 sides.")
-                else:
-                    angle = 360.0 / sides
-                    for _ in range(sides):
-                        t.forward(size)
-                        t.right(angle)
-            except Exception:
-                respond(ENGINE, "Invalid polygon format. Use polygon:n")
-        elif shape.startswith("flower"):
-            parts = shape.split(":")
-            petals = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 6
-            draw_flower(petals=petals, size=size//2, color=color)
+                job = jobs.get_nowait()
+            except queue.Empty:
+                break
+            if job is None:
+                screen.bye()
+                return
+            job_id, paths, filled, color, speed = job
+            start = time.perf_counter()
+            try:
+                screen.clear()
+                screen.tracer(0)
+                t = turtle.Turtle(visible=False)
+                t.color(color)
+                _turtle_replay(t, screen, paths, filled, speed)
+                screen.update()
+                events.put(("done", job_id, round((time.perf_counter() - start) * 1000, 1)))
+            except Exception as e:
+                events.put(("error", job_id, str(e)))
+        screen.ontimer(poll, RENDER_POLL_MS)
+    screen.ontimer(poll, RENDER_POLL_MS)
+    events.put(("ready", None, None))
+    with contextlib.suppress(Exception):
+        screen.mainloop()
+
+class RenderWorker:
+    # Parent-side handle for the render process. submit() returns a job id at
+    # once; a listener thread turns the worker's events into notify(shape,
+    # status, detail) calls and wakes anyone blocked in wait(). The process is
+    # (re)started on demand, e.g. after the user closes the window.
+    def __init__(self, notify=None):
+        self.notify = notify
+        self._proc = None
+        self._jobs = None
+        self._ids = itertools.count(1)
+        self._pending = {}     # job id -> [shape, Event, (status, detail), process]
+        self._finished = collections.OrderedDict()   # the last few finished jobs, for wait()
+        self._lock = threading.Lock()
+
+    def _ensure_running(self):
+        if self._proc is not None and self._proc.is_alive():
             return
-        else:
-            respond(ENGINE, "Shape not recognized. Use square, triangle, circle, star, heart, spiral, polygon:n, flower:n")
-    except Exception as e:
-        logging.error("draw_shape error: %s", e)
-        respond(ENGINE, "Drawing failed due to an error.")
-    respond(ENGINE, "Drawing complete. Close the turtle window to continue.")
-    screen.mainloop()
+        mp = importlib.import_module("multiprocessing")
+        self._jobs, events = mp.Queue(), mp.Queue()
+        self._proc = mp.Process(target=_render_main, args=(self._jobs, events), name="lexchat-render", daemon=True)
+        self._proc.start()
+        threading.Thread(target=self._listen, args=(self._proc, events), name="render-events", daemon=True).start()
+
+    def submit(self, shape, color="blue", size=100, speed=5):
+        # raises ValueError for an unknown shape before anything is queued
+        paths, filled = shape_paths(shape, size)
+        with self._lock:
+            self._ensure_running()
+            job_id = next(self._ids)
+            self._pending[job_id] = [shape, threading.Event(), None, self._proc]
+            self._jobs.put((job_id, paths, filled, color, speed))
+        return job_id
+
+    def wait(self, job_id, timeout=None):
+        # (status, detail) once the job finished, None if it is still running
+        with self._lock:
+            job = self._pending.get(job_id) or self._finished.get(job_id)
+        if job is None or not job[1].wait(timeout):
+            return None
+        return job[2]
+
+    def _finish(self, job_id, status, detail):
+        with self._lock:
+            job = self._pending.pop(job_id, None)
+            if job is None:
+                return
+            job[2] = (status, detail)
+            self._finished[job_id] = job
+            while len(self._finished) > 64:
+                self._finished.popitem(last=False)
+        job[1].set()
+        if self.notify:
+            try:
+                self.notify(job[0], status, detail)
+            except Exception as e:
+                logging.error("render notify failed: %s", e)
+
+    def _listen(self, proc, events):
+        while True:
+            try:
+                kind, job_id, detail = events.get(timeout=0.5)
+            except queue.Empty:
+                if proc.is_alive():
+                    continue
+                kind, job_id, detail = "closed", None, "the drawing window was closed"
+            except (EOFError, OSError):
+                kind, job_id, detail = "closed", None, "the render process stopped"
+            if kind == "ready":
+                continue
+            if job_id is not None:
+                self._finish(job_id, kind, detail)
+                continue
+            # the process is gone: fail whatever it still owed us
+            logging.error("render worker stopped: %s", detail)
+            with self._lock:
+                if self._proc is proc:
+                    self._proc = None
+                owed = [jid for jid, job in self._pending.items() if job[3] is proc]
+            for jid in owed:
+                self._finish(jid, "error", detail)
+            return
+
+    def close(self, timeout=2.0):
+        proc = self._proc
+        if proc is None or not proc.is_alive():
+            return
+        self._jobs.put(None)
+        proc.join(timeout)
+        if proc.is_alive():
+            proc.terminate()
+
+def _render_notice(shape, status, detail):
+    if status == "done":
+        respond(ENGINE, f"Finished drawing {shape}.", priority=SPEECH_LOW)
+    else:
+        respond(ENGINE, f"Drawing {shape} failed: {detail}", priority=SPEECH_LOW)
+
+RENDERER = RenderWorker(notify=_render_notice)
+atexit.register(RENDERER.close)
+
+def draw_shape(shape="square", color="blue", size=100, speed=5):
+    return RENDERER.submit(shape.strip().lower(), color, size, speed)
 
 
 def generate_python(kind):
@@ -401,19 +2741,360 @@ def generate_code(language, kind, save=False, filename=None):
             logging.error("save snippet error: %s", e)
             respond(ENGINE, "Failed to save snippet.")
     else:
-        save_history({"type":"code","lang":language,"kind":kind,"time":now_str()})
+        save_history({"type":"code","lang":language,"kind":kind,"time":now_str()})
+
+
+# ---- number theory ----
+SIEVE_CACHE_LIMIT = 10_000_000     # primes below this come from one cached sieve
+SIEVE_SEGMENT = 1 << 20            # segment size for sieving beyond the cache
+COUNT_PRIMES_MAX = 100_000_000     # largest N "count primes up to N" will sieve (~1 s)
+NTH_PRIME_MAX = 5_000_000          # largest n "nth prime" will look for (~1 s)
+FACTOR_MAX_DIGITS = 100            # longest number "factor" accepts
+FACTOR_RHO_STEPS = 500_000         # Pollard rho iterations per factorization (~1 s)
+MR_EXTRA_ROUNDS = 16               # random Miller-Rabin bases beyond the proven range
+
+# with these bases Miller-Rabin is exact for every n < 3.3e24, which covers 64-bit
+_MR_BASES = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41)
+_MR_DETERMINISTIC_LIMIT = 3317044064679887385961981
+_SIEVE = bytearray()
+
+def prime_sieve(limit):
+    # cached sieve of Eratosthenes: sieve[i] == 1 iff i is prime, for i < limit
+    global _SIEVE
+    if len(_SIEVE) < limit:
+        size = min(max(limit, 2 * len(_SIEVE), 1 << 16), max(limit, SIEVE_CACHE_LIMIT))
+        sieve = bytearray([1]) * size
+        sieve[0:2] = b"\x00\x00"
+        for p in range(2, math.isqrt(size - 1) + 1):
+            if sieve[p]:
+                sieve[p * p::p] = bytes(len(range(p * p, size, p)))
+        _SIEVE = sieve
+    return _SIEVE
+
+def _small_primes(limit):
+    return list(itertools.compress(range(limit), prime_sieve(limit)[:limit]))
+
+def _miller_rabin(n, a, d, s):
+    x = pow(a, d, n)
+    if x == 1 or x == n - 1:
+        return True
+    for _ in range(s - 1):
+        x = x * x % n
+        if x == n - 1:
+            return True
+    return False
+
+def is_prime(n):
+    n = int(n)
+    if n < 2:
+        return False
+    if n < len(_SIEVE) or n < 1 << 16:
+        return bool(prime_sieve(n + 1)[n])
+    for p in _MR_BASES:
+        if n % p == 0:
+            return n == p
+    d, s = n - 1, 0
+    while d % 2 == 0:
+        d //= 2
+        s += 1
+    if not all(_miller_rabin(n, a, d, s) for a in _MR_BASES):
+        return False
+    if n < _MR_DETERMINISTIC_LIMIT:
+        return True
+    # beyond the proven range: probabilistic, wrong with probability < 4**-rounds
+    rng = random.Random(n)
+    return all(_miller_rabin(n, rng.randrange(2, n - 1), d, s) for _ in range(MR_EXTRA_ROUNDS))
+
+def next_prime(n):
+    n = int(n)
+    if n < 2:
+        return 2
+    candidate = n + 1 if n % 2 == 0 else n + 2   # next odd number above n
+    while not is_prime(candidate):
+        candidate += 2
+    return candidate
+
+def _segments(lo, hi):
+    # segmented sieve over [lo, hi): yields (start, bytearray) with 1 marking primes
+    base = _small_primes(math.isqrt(hi - 1) + 1)
+    for start in range(lo, hi, SIEVE_SEGMENT):
+        end = min(start + SIEVE_SEGMENT, hi)
+        seg = bytearray([1]) * (end - start)
+        for p in base:
+            first = max(p * p, (start + p - 1) // p * p)
+            if first >= end:
+                if p * p >= end:
+                    break
+                continue
+            seg[first - start::p] = bytes(len(range(first - start, end - start, p)))
+        yield start, seg
+
+def count_primes(n):
+    n = int(n)
+    if n < 2:
+        return 0
+    if n < SIEVE_CACHE_LIMIT:
+        return prime_sieve(n + 1)[:n + 1].count(1)
+    total = prime_sieve(SIEVE_CACHE_LIMIT).count(1)
+    for _, seg in _segments(SIEVE_CACHE_LIMIT, n + 1):
+        total += seg.count(1)
+    return total
+
+def nth_prime(k):
+    k = int(k)
+    if k < 1:
+        raise ValueError("n must be at least 1")
+    # Rosser's bound: p_k < k (ln k + ln ln k) for k >= 6
+    bound = 15 if k < 6 else int(k * (math.log(k) + math.log(math.log(k)))) + 1
+    if bound < SIEVE_CACHE_LIMIT:
+        sieve = prime_sieve(bound + 1)
+        return next(itertools.islice(itertools.compress(itertools.count(), sieve), k - 1, None))
+    seen = prime_sieve(SIEVE_CACHE_LIMIT).count(1)
+    if seen >= k:
+        return next(itertools.islice(itertools.compress(itertools.count(), _SIEVE), k - 1, None))
+    for start, seg in _segments(SIEVE_CACHE_LIMIT, bound + 1):
+        here = seg.count(1)
+        if seen + here >= k:
+            return next(itertools.islice(itertools.compress(itertools.count(start), seg), k - seen - 1, None))
+        seen += here
+    raise ValueError("prime bound exceeded")
+
+def _pollard_rho(n, budget):
+    # Brent's variant of Pollard's rho -> (a non-trivial factor of odd composite
+    # n, or None once budget iterations are spent; iterations used)
+    if n % 2 == 0:
+        return 2, 0
+    rng = random.Random(n)
+    steps = 0
+    while steps < budget:
+        y, c, m = rng.randrange(1, n), rng.randrange(1, n), 128
+        g = r = q = 1
+        while g == 1:
+            if steps + r > budget:
+                return None, steps
+            x = y
+            for _ in range(r):
+                y = (y * y + c) % n
+            steps += r
+            k = 0
+            while k < r and g == 1 and steps < budget:
+                ys = y
+                for _ in range(min(m, r - k)):
+                    y = (y * y + c) % n
+                    q = q * abs(x - y) % n
+                g = math.gcd(q, n)
+                k += m
+                steps += m
+            r *= 2
+        if g == 1:
+            break
+        if g == n:
+            g = 1
+            while g == 1:
+                ys = (ys * ys + c) % n
+                g = math.gcd(abs(x - ys), n)
+                steps += 1
+        if g != n:
+            return g, steps
+    return None, steps
+
+def factorize(n, budget=FACTOR_RHO_STEPS):
+    # -> (prime factors, composite cofactors left unsplit when the budget ran out)
+    n = int(n)
+    if n < 2:
+        return [], []
+    factors, unsplit = [], []
+    for p in _small_primes(1000):
+        while n % p == 0:
+            factors.append(p)
+            n //= p
+    stack = [n] if n > 1 else []
+    while stack:
+        m = stack.pop()
+        if is_prime(m):
+            factors.append(m)
+            continue
+        d, used = _pollard_rho(m, budget)
+        budget -= used
+        if d is None:
+            unsplit.append(m)
+        else:
+            stack.extend((d, m // d))
+    return sorted(factors), sorted(unsplit)
+
+# ---- expression calculator ----
+# Spoken or typed expressions ("what is two hundred times sqrt of 81 plus 7")
+# are rewritten into Python syntax, parsed with ast and evaluated by a small
+# whitelist-only walker. Parsed expressions are memoized.
+CALC_VARS = {}            # user variables; "ans" holds the last result
+CALC_MAX_EXPONENT = 10000
+CALC_MAX_FACTORIAL = 5000
+CALC_MAX_BITS = 100000    # largest integer result computed (~30,000 digits)
+CALC_MAX_DIGITS = 4000    # longer integers are shown in scientific notation
+
+
+class CalcIncomplete(Exception):
+    # the text isn't a complete expression (missing operand, unknown word...)
+    pass
+
+
+def _factorial(x):
+    if x != int(x) or x < 0:
+        raise ValueError("factorial needs a whole number of at least 0")
+    if x > CALC_MAX_FACTORIAL:
+        raise ValueError("factorial argument too large")
+    return math.factorial(int(x))
+
+_CALC_FUNCS = {
+    "sqrt": math.sqrt, "log": math.log10, "ln": math.log, "exp": math.exp,
+    "sin": math.sin, "cos": math.cos, "tan": math.tan, "abs": abs,
+    "round": round, "floor": math.floor, "ceil": math.ceil, "factorial": _factorial,
+}
+_CALC_CONSTS = {"pi": math.pi, "e": math.e, "tau": math.tau}
+_CALC_BINOPS = {
+    ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul,
+    ast.Div: operator.truediv, ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod, ast.Pow: operator.pow,
+}
+_CALC_UNARY = {ast.UAdd: operator.pos, ast.USub: operator.neg}
+
+_CALC_PREFIX = re.compile(r"^\s*(?:what\s+is|what's|whats|how\s+much\s+is|calculate|calculator|calc|compute|evaluate|math)\b\s*")
+_CALC_PHRASES = [(re.compile(p), r) for p, r in (
+    (r"\bto the power of\b|\braised to(?: the power of)?\b|\^", " ** "),
+    (r"\bmultiplied by\b|\btimes\b|×", " * "),
+    (r"\bdivided by\b|\bover\b|÷", " / "),
+    (r"\bplus\b", " + "),
+    (r"\bminus\b|\bnegative\b", " - "),
+    (r"\bmod(?:ulo)?\b", " % "),
+    (r"\bsquared\b", " ** 2 "),
+    (r"\bcubed\b", " ** 3 "),
+    (r"\bsquare root(?: of)?\b|\broot of\b", " sqrt "),
+    (r"\b(sqrt|log|ln|exp|sin|cos|tan|abs|round|floor|ceil|factorial) of\b", r" \1 "),
+    (r"\bpercent of\b", " / 100 * "),
+    (r"\bpercent\b|%(?=\s*$)", " / 100 "),
+    (r"\bopen (?:paren|parenthesis|bracket)\b", " ( "),
+    (r"\bclose (?:paren|parenthesis|bracket)\b", " ) "),
+    (r"^let (\w+) (?:be|equal|equals)\b", r"\1 = "),
+    (r"\bequals?\b|\bthe\b|\?", " "),
+)]
+_CALC_TOKEN = re.compile(r"[a-z_]\w*|\d+(?:\.\d+)?|\.\d+|\*\*|[-+*/%()=,]")
+_CALC_APPLY = re.compile(r"\b(" + "|".join(_CALC_FUNCS) + r")\s+(-?\d+(?:\.\d+)?|[a-z_]\w*)(?!\s*\()")
+
+def _number_runs(tokens):
+    # collapse runs of number words into digits: "two hundred and five" -> "205"
+    out, run = [], []
+    def close():
+        trailing = []
+        while run and run[-1] == "and":
+            trailing.append(run.pop())
+        if run:
+            val = parse_number(" ".join(run))
+            out.append(format_number(val) if val is not None else " ".join(run))
+            run.clear()
+        out.extend(trailing)
+    for tok in tokens:
+        if (tok in _NUMBER_WORDS and not tok.isdigit() and tok not in _ORDINALS) \
+                or (tok in ("and", "point") and run and (run[-1] == "hundred" or run[-1] in _SCALES or tok == "point")):
+            run.append(tok)
+        else:
+            close()
+            out.append(tok)
+    close()
+    return out
+
+def normalize_expression(text):
+    expr = (text or "").lower().strip()
+    while True:
+        stripped = _CALC_PREFIX.sub("", expr, count=1)
+        if stripped == expr:
+            break
+        expr = stripped
+    for pattern, repl in _CALC_PHRASES:
+        expr = pattern.sub(repl, expr)
+    expr = " ".join(_number_runs(_CALC_TOKEN.findall(expr.replace(",", ""))))
+    # "sqrt 81" -> "sqrt(81)"
+    while True:
+        applied = _CALC_APPLY.sub(r"\1(\2)", expr)
+        if applied == expr:
+            break
+        expr = applied
+    return expr
+
+@functools.lru_cache(maxsize=256)
+def compile_expression(expr):
+    if not expr:
+        raise CalcIncomplete("empty expression")
+    try:
+        return ast.parse(expr, mode="eval").body
+    except SyntaxError as e:
+        raise CalcIncomplete(str(e))
+
+def _check_result_size(op, left, right):
+    # refuse integer results over CALC_MAX_BITS before computing them, so
+    # "(9 ** 9999) ** 9999" fails at once instead of running for minutes
+    if not (isinstance(left, int) and isinstance(right, int)):
+        return   # float arithmetic overflows on its own
+    if isinstance(op, ast.Pow):
+        bits = abs(left).bit_length() * right if right > 0 and abs(left) > 1 else 0
+    elif isinstance(op, ast.Mult):
+        bits = abs(left).bit_length() + abs(right).bit_length()
+    else:
+        return
+    if bits > CALC_MAX_BITS:
+        raise ValueError("result too large")
 
+def _calc_eval(node, env):
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+        return node.value
+    if isinstance(node, ast.Name):
+        if node.id in env:
+            return env[node.id]
+        if node.id in _CALC_CONSTS:
+            return _CALC_CONSTS[node.id]
+        raise CalcIncomplete(f"unknown name {node.id}")
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _CALC_UNARY:
+        return _CALC_UNARY[type(node.op)](_calc_eval(node.operand, env))
+    if isinstance(node, ast.BinOp) and type(node.op) in _CALC_BINOPS:
+        left = _calc_eval(node.left, env)
+        right = _calc_eval(node.right, env)
+        if isinstance(node.op, ast.Pow) and abs(right) > CALC_MAX_EXPONENT:
+            raise ValueError("exponent too large")
+        _check_result_size(node.op, left, right)
+        return _CALC_BINOPS[type(node.op)](left, right)
+    if (isinstance(node, ast.Call) and isinstance(node.func, ast.Name)
+            and node.func.id in _CALC_FUNCS and not node.keywords):
+        return _CALC_FUNCS[node.func.id](*(_calc_eval(a, env) for a in node.args))
+    raise CalcIncomplete(f"unsupported syntax: {type(node).__name__}")
 
-def is_prime(n):
-    n = int(n)
-    if n <= 1: return False
-    if n <= 3: return True
-    if n % 2 == 0: return False
-    r = int(math.sqrt(n))
-    for i in range(3, r+1, 2):
-        if n % i == 0:
-            return False
-    return True
+def evaluate_expression(text, env=None):
+    # returns (value, normalized expression); "x = ..." also stores x
+    if env is None:
+        env = _SESSION.get().calc_vars if _SESSION.get() is not None else CALC_VARS
+    expr = normalize_expression(text)
+    target = None
+    m = re.match(r"^([a-z_]\w*)\s*=\s*(.+)$", expr)
+    if m:
+        target, expr = m.group(1), m.group(2)
+        if target in _CALC_FUNCS or target in _CALC_CONSTS:
+            raise ValueError(f"{target} is a reserved name")
+    value = _calc_eval(compile_expression(expr), env)
+    if isinstance(value, complex):
+        raise ValueError("complex result")
+    if target:
+        env[target] = value
+    env["ans"] = value
+    return value, (f"{target} = {expr}" if target else expr)
+
+def format_number(x):
+    if isinstance(x, float):
+        if x.is_integer() and abs(x) < 1e15:
+            return str(int(x))
+        return f"{x:.10g}"
+    if isinstance(x, int) and abs(x).bit_length() > CALC_MAX_DIGITS * 3.3219:
+        exp = math.floor(math.log10(abs(x)))
+        mantissa = abs(x) // 10 ** (exp - 9) / 1e9
+        return f"{'-' if x < 0 else ''}{mantissa:.9f}e+{exp}"
+    return str(x)
 
 EMOJIS = ["😄","😎","🤖","😜","🔥","💡","🎨","⚡","🌟","🧠","😂","😇","🤩","🚀","🎯","🎶","🕹️","📘","🐍","💻","🎲","💬","✨","❤️","🦾","🌈","📡","🧩","🎁","🔮"]
 JOKES = [
@@ -453,7 +3134,9 @@ FUN_FACTS = [
 ]
 
 COMMANDS_HELP = [
-    "search — search the web",
+    "search — search the web (search --refresh skips the cache, search stats shows cache hits)",
+    "recognizer stats — latency and failures per speech recognition backend",
+    "stats — per-stage timings (p50/p95/p99) by command, also saved as JSON (stats reset clears them)",
     "last search — show last search",
     "code — generate code (python/html/js) & explain",
     "draw / turtle — draw shapes (square, circle, triangle, star, heart, spiral, polygon:n, flower:n)",
@@ -461,10 +3144,12 @@ COMMANDS_HELP = [
     "fact — tell a fun fact",
     "time — tell current time",
     "math / calc — calculator, factorial, sqrt, prime check",
+    "next prime / nth prime / count primes / factor — number theory (e.g. next prime after 100)",
     "story — build a short story",
     "game — rock-paper-scissors",
     "lists/tuples/sets — show examples and help",
-    "set voice — change voice to calm/balanced/energetic",
+    "set voice — change voice to calm/balanced/energetic or a saved profile",
+    "new voice — save a voice profile (rate, volume, voice id)",
     "history — show recent actions",
     "help — show this list",
     "exit / quit — exit program"
@@ -475,23 +3160,144 @@ def show_help():
     for c in COMMANDS_HELP:
         print("-", c)
 
-INTENT_CANDIDATES = [
-    "search","last search","code","draw","joke","fact","time",
-    "math","story","game","help","set voice","history","lists","exit","quit"
-]
+# Extra phrasings for the fuzzy matcher on top of every command's trigger
+# phrases: synonyms plus words speech recognition commonly hears instead.
+INTENT_SYNONYMS = {
+    "search": ["surch", "serch", "search for", "web search", "google it", "find online", "look it up"],
+    "last search": ["last surch", "recent search", "my last results"],
+    "code": ["coat", "coding", "write code", "program", "snippet"],
+    "draw": ["drawl", "drawing", "paint", "sketch", "turtle graphics"],
+    "joke": ["choke", "joak", "make me laugh", "something funny"],
+    "fact": ["fax", "fun fact", "trivia", "tell me something"],
+    "time": ["thyme", "tyme", "what's the time", "current time"],
+    "math": ["maths", "mass", "calculate", "arithmetic", "calculater"],
+    "story": ["storey", "stori", "tell a tale", "make a story"],
+    "game": ["gaim", "games", "play", "rock paper"],
+    "help": ["halp", "what can you do", "menu", "options"],
+    "set voice": ["said voice", "set boys", "voice settings", "change your voice"],
+    "history": ["histry", "his story", "recent actions", "what did i do"],
+    "lists": ["list example", "python lists", "data types"],
+    "temperature": ["temprature", "tempreture", "celsius", "fahrenheit"],
+    "weight": ["wait", "kilograms", "pounds"],
+    "exit": ["exet", "leave", "stop", "good night"],
+}
+INTENT_PHRASES_FILE = "lexchat_env/intent_phrases.json"   # {"intent": ["phrase", ...]}
+FUZZY_CUTOFF = 0.45
+FUZZY_CANDIDATES = 3      # intents tried in turn when a guarded one declines the utterance
+
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class IntentIndex:
+    # Character-trigram index over the phrase table. A lookup only scores
+    # phrases that share a trigram with the utterance (or one of its 1-3 word
+    # windows) and ranks them by Dice similarity; recent utterances are memoized.
+    def __init__(self, memo_size=512):
+        self.phrases = []      # (phrase, intent, trigram count)
+        self.postings = {}     # trigram -> [phrase ids]
+        self._seen = set()
+        self._memo = functools.lru_cache(maxsize=memo_size)(self._match)
+
+    def add(self, phrase, intent):
+        phrase = " ".join((phrase or "").lower().split())
+        if not phrase or (phrase, intent) in self._seen:
+            return
+        self._seen.add((phrase, intent))
+        grams = trigrams(phrase)
+        pid = len(self.phrases)
+        self.phrases.append((phrase, intent, len(grams)))
+        for g in grams:
+            self.postings.setdefault(g, []).append(pid)
+        self._memo.cache_clear()
 
-def fuzzy_intent(text, cutoff=0.5):
-    text = (text or "").lower().strip()
-    match = difflib.get_close_matches(text, INTENT_CANDIDATES, n=1, cutoff=cutoff)
-    return match[0] if match else None
+    def _score(self, query):
+        grams = trigrams(query)
+        shared = collections.Counter()
+        for g in grams:
+            for pid in self.postings.get(g, ()):
+                shared[pid] += 1
+        n = len(grams)
+        return {pid: 2.0 * k / (n + self.phrases[pid][2]) for pid, k in shared.items()}
+
+    def _match(self, text, limit):
+        words = text.split()
+        best = self._score(text)
+        if len(words) > 1:
+            # a short phrase inside a longer utterance ("please tell a jok")
+            for size in (1, 2, 3):
+                for i in range(len(words) - size + 1):
+                    for pid, sc in self._score(" ".join(words[i:i + size])).items():
+                        sc *= 0.9
+                        if sc > best.get(pid, 0.0):
+                            best[pid] = sc
+        ranked = {}
+        # ties go to the longer phrase, then the one added first, so the
+        # winner never depends on set iteration order (hash seed)
+        order = sorted(best.items(), key=lambda kv: (-kv[1], -len(self.phrases[kv[0]][0]), kv[0]))
+        for pid, sc in order:
+            intent = self.phrases[pid][1]
+            if intent not in ranked:
+                ranked[intent] = (intent, self.phrases[pid][0], round(sc, 3))
+            if len(ranked) >= limit:
+                break
+        return tuple(ranked.values())
+
+    def match(self, text, limit=1):
+        text = " ".join((text or "").lower().split())
+        return list(self._memo(text, limit)) if text else []
+
+
+_INTENT_INDEX = None
+
+def intent_index():
+    global _INTENT_INDEX
+    if _INTENT_INDEX is None:
+        index = IntentIndex()
+        for name, phrases, _fn in COMMANDS:
+            index.add(name, name)
+            for p in phrases:
+                index.add(p, name)
+        extra = {}
+        if os.path.exists(INTENT_PHRASES_FILE):
+            try:
+                with open(INTENT_PHRASES_FILE, "r", encoding="utf-8") as f:
+                    extra = json.load(f)
+            except Exception as e:
+                logging.warning("could not load intent phrases: %s", e)
+        for table in (INTENT_SYNONYMS, extra):
+            for intent, phrases in table.items():
+                if intent in COMMAND_HANDLERS:
+                    for p in phrases:
+                        index.add(p, intent)
+        _INTENT_INDEX = index
+    return _INTENT_INDEX
+
+def fuzzy_intent_scored(text):
+    for intent, _phrase, score in intent_index().match(text, FUZZY_CANDIDATES):
+        if command_accepts(intent, text):
+            return intent, score
+    return None, 0.0
+
+def fuzzy_intent(text, cutoff=FUZZY_CUTOFF):
+    intent, score = fuzzy_intent_scored(text)
+    return intent if score >= cutoff else None
 
 
 def ask_input(prompt, mode="text", record_secs=VOICE_RECORD_SECONDS):
+    if _BATCH_TURN is not None:
+        return _BATCH_TURN.answer(prompt)
+    if _SESSION.get() is not None:
+        return _SESSION.get().ask(prompt)
+    if mode == "wake" and WAKE_LISTENER is not None:
+        return WAKE_LISTENER.next_answer()
     if mode == "voice":
-        filename = record_audio(duration=record_secs)
-        if not filename:
+        audio = record_audio(duration=record_secs)
+        if audio is None:
             return ""
-        return recognize_file(filename)
+        return recognize_audio(audio)
     else:
         try:
             return input(prompt)
@@ -499,264 +3305,1268 @@ def ask_input(prompt, mode="text", record_secs=VOICE_RECORD_SECONDS):
             return ""
 
 
-def execute_command(command, mode="text"):
-    cmd = (command or "").strip().lower()
-    logging.info("CMD: %s (mode=%s)", cmd, mode)
-    save_history({"type":"command","cmd":cmd,"mode":mode,"time":now_str()})
+# ---- command routing ----
+# Each handler declares the phrases that trigger it. The phrases are compiled
+# once into an index keyed by their first word, so routing a command only
+# looks at the words it contains, however many commands are registered.
+# When several phrases match, the longest wins; ties go to the command that
+# was registered first. A command registered with when=predicate only claims
+# an utterance the predicate accepts; otherwise routing moves on to the next
+# matching phrase, then to fuzzy matching.
+COMMANDS = []
+COMMAND_HANDLERS = {}
+COMMAND_GUARDS = {}
+_ROUTES = None
 
-    if cmd == "":
-        return True
+def command(name, *phrases, when=None):
+    def deco(fn):
+        global _ROUTES, _INTENT_INDEX
+        COMMANDS.append((name, phrases, fn))
+        COMMAND_HANDLERS[name] = fn
+        if when is not None:
+            COMMAND_GUARDS[name] = when
+        _ROUTES = None
+        _INTENT_INDEX = None
+        return fn
+    return deco
 
+def command_accepts(name, text):
+    guard = COMMAND_GUARDS.get(name)
+    return guard is None or guard(text)
 
-    if any(w in cmd for w in ["hello","hi","hey","good morning","good evening"]):
-        respond(ENGINE, random.choice([f"Hello Gabriel {random.choice(EMOJIS)}","Hi Gabriel — ready when you are!", "Hey — what shall we do today?"]))
-        return True
+def command_tokens(text):
+    return re.findall(r"[a-z0-9]+", (text or "").lower())
 
+def compile_routes(commands):
+    index = {}
+    for order, (name, phrases, fn) in enumerate(commands):
+        for phrase in phrases:
+            words = tuple(command_tokens(phrase))
+            if words:
+                index.setdefault(words[0], []).append((words, order, name, fn))
+    for entries in index.values():
+        entries.sort(key=lambda e: (-len(e[0]), e[1]))
+    return index
 
-    if any(w in cmd for w in ["exit","quit","goodbye","bye"]):
-        respond(ENGINE, "Goodbye Gabriel. Take care!", pause=0.3)
-        return False
+def route(cmd, index=None):
+    global _ROUTES
+    if index is None:
+        if _ROUTES is None:
+            _ROUTES = compile_routes(COMMANDS)
+        index = _ROUTES
+    tokens = command_tokens(cmd)
+    best = None
+    for i, tok in enumerate(tokens):
+        for words, order, name, fn in index.get(tok, ()):
+            if tuple(tokens[i:i + len(words)]) == words and command_accepts(name, cmd):
+                if best is None or (-len(words), order) < (-len(best[0]), best[1]):
+                    best = (words, order, name, fn)
+                break   # entries are sorted, the first accepted hit is this word's best
+    return (best[2], best[3]) if best else (None, None)
 
 
-    if "help" in cmd or "commands" in cmd:
-        show_help()
-        return True
+@command("greet", "hello", "hi", "hey", "good morning", "good evening")
+def cmd_greet(cmd, mode):
+    respond(ENGINE, random.choice([f"Hello Gabriel {random.choice(EMOJIS)}","Hi Gabriel — ready when you are!", "Hey — what shall we do today?"]))
+    return True
 
-    if "set voice" in cmd or cmd.startswith("voice mode") or ("voice" in cmd and "set" in cmd):
-        tokens = cmd.replace("set voice","").replace("voice mode","").replace("set voice to","").strip()
-        if not tokens:
-            respond(ENGINE, "Which mode: calm, balanced, or energetic?")
-            ask = ask_input("Mode: ", mode=mode)
-            tokens = ask.lower().strip()
-        chosen = tokens.split()[0] if tokens else DEFAULT_VOICE_MODE
-        if chosen in ("calm","balanced","energetic"):
-            set_voice_mode(chosen)
-        else:
-            respond(ENGINE, "I only know calm, balanced, or energetic.")
+@command("exit", "exit", "quit", "goodbye", "bye")
+def cmd_exit(cmd, mode):
+    respond(ENGINE, "Goodbye Gabriel. Take care!", pause=0.3)
+    return False
+
+@command("help", "help", "commands")
+def cmd_help(cmd, mode):
+    show_help()
+    return True
+
+@command("new voice", "new voice", "voice profile")
+def cmd_new_voice(cmd, mode):
+    respond(ENGINE, "What should the new voice profile be called?")
+    name = ask_input("Profile name: ", mode=mode).lower().strip()
+    if not name:
+        respond(ENGINE, "A profile needs a name.")
         return True
+    rate = parse_number(ask_input("Rate (words per minute, e.g. 170): ", mode=mode)) or 175
+    volume = parse_number(ask_input("Volume (0 to 1): ", mode=mode))
+    volume = 1.0 if volume is None else min(max(volume, 0.0), 1.0)
+    voice = ask_input("Voice id or number (enter for default): ", mode=mode).strip() or None
+    define_voice_profile(name.split()[0], rate, volume, voice)
+    return True
+
+@command("set voice", "set voice", "voice mode", "change voice", "voice")
+def cmd_set_voice(cmd, mode):
+    tokens = [w for w in cmd.split() if w not in ("set", "change", "voice", "mode", "to", "my", "the")]
+    if not tokens:
+        respond(ENGINE, f"Which mode: {', '.join(voice_profiles())}?")
+        tokens = ask_input("Mode: ", mode=mode).lower().split()
+    chosen = tokens[0] if tokens else DEFAULT_VOICE_MODE
+    if chosen in voice_profiles():
+        set_voice_mode(chosen)
+    else:
+        respond(ENGINE, f"I only know {', '.join(voice_profiles())}.")
+    return True
+
+@command("time", "time", "clock", "what is the time", "what's the time", "what time")
+def cmd_time(cmd, mode):
+    t = datetime.now().strftime("%H:%M:%S")
+    respond(ENGINE, f"The current time is {t} {random.choice(EMOJIS)}")
+    return True
+
+@command("history", "history")
+def cmd_history(cmd, mode):
+    # a server session sees only its own entries
+    sid = _SESSION.get().id if _SESSION.get() is not None else None
+    total = HISTORY.count(session=sid)
+    if total:
+        respond(ENGINE, f"I have {total} history entries. Showing last 8.")
+        for item in HISTORY.tail(8, session=sid):
+            print(item)
+    else:
+        respond(ENGINE, "No history found.")
+    return True
+
+_HISTORY_KINDS = {
+    "command": "command", "commands": "command", "search": "search", "searches": "search",
+    "draw": "draw", "draws": "draw", "drawing": "draw", "drawings": "draw",
+    "story": "story", "stories": "story",
+}
+_SINCE_UNITS = {"minute": 60, "hour": 3600, "day": 86400, "week": 7 * 86400,
+                "month": 30 * 86400, "year": 365 * 86400}
+_WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+
+def parse_since(text, now=None):
+    # "yesterday", "last week", "three days ago", "monday", "2025-01-31",
+    # "march 3" -> datetime, None when the phrase isn't understood
+    now = now or datetime.now()
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    t = re.sub(r"^(?:the|a)\s+", "", (text or "").strip().lower())
+    if t in ("", "today", "this morning"):
+        return midnight
+    if t == "yesterday":
+        return midnight - timedelta(days=1)
+    m = re.fullmatch(r"(?:last|past|this)\s+(minute|hour|day|week|month|year)", t)
+    if m:
+        return now - timedelta(seconds=_SINCE_UNITS[m.group(1)])
+    m = re.fullmatch(r"(.+?)\s+(minute|hour|day|week|month|year)s?\s+ago", t)
+    if m:
+        n = 1 if m.group(1) in ("a", "an", "one") else parse_number(m.group(1))
+        if n is None:
+            return None
+        try:
+            return now - timedelta(seconds=n * _SINCE_UNITS[m.group(2)])
+        except OverflowError:
+            # "ten thousand years ago": before anything datetime can hold
+            return datetime.min if n > 0 else None
+    m = re.fullmatch(r"(?:last\s+)?(" + "|".join(_WEEKDAYS) + r")", t)
+    if m:
+        back = (now.weekday() - _WEEKDAYS.index(m.group(1))) % 7
+        return midnight - timedelta(days=back or (7 if t.startswith("last") else 0))
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d", "%B %d %Y", "%B %d", "%d %B %Y", "%d %B"):
+        try:
+            when = datetime.strptime(re.sub(r"(?<=\d)(?:st|nd|rd|th)\b|,", "", t), fmt)
+        except ValueError:
+            continue
+        return when.replace(year=now.year) if "%Y" not in fmt else when
+    return None
+
+def _history_kind(words):
+    # pull an entry type ("searches", "draw") out of the words -> (type, rest)
+    for i, w in enumerate(words):
+        if w in _HISTORY_KINDS:
+            return _HISTORY_KINDS[w], words[:i] + words[i + 1:]
+    return None, words
 
+def show_history_entries(items):
+    for item in items:
+        print(f"{item.get('time', ''):<19}  {item.get('type', '?'):<8} {history_text(item)}")
 
-    if "time" in cmd:
-        t = datetime.now().strftime("%H:%M:%S")
-        respond(ENGINE, f"The current time is {t} {random.choice(EMOJIS)}")
+@command("history search", "history search", "search history", "find in history")
+def cmd_history_search(cmd, mode):
+    # "history search red", "history search draw red": newest matches first
+    rest = re.sub(r"^(?:history\s+search|search\s+history|find\s+in\s+history)(?:\s+for)?\s*", "", cmd)
+    words = rest.split()
+    kind = None
+    if len(words) > 1 or (words and words[0] in _HISTORY_KINDS):
+        kind, words = _history_kind(words)
+    if not words and kind is None:
+        respond(ENGINE, "What should I look for in your history?")
+        words = ask_input("Search history for: ", mode=mode).lower().split()
+    session = _SESSION.get()
+    start = time.perf_counter()
+    if words:
+        found = HISTORY.search(" ".join(words), kind=kind, session=session.id if session else None)
+    else:
+        found = HISTORY.since("", kind=kind, session=session.id if session else None)[1]
+    ms = (time.perf_counter() - start) * 1000
+    what = " ".join(words) or f"{kind} entries"
+    if not found:
+        respond(ENGINE, f"Nothing in your history matches {what}.")
         return True
+    respond(ENGINE, f"Found {len(found)}{'+' if len(found) >= HISTORY_SEARCH_LIMIT else ''} matches for {what}, newest first.")
+    show_history_entries(found)
+    print(f"({ms:.1f} ms)")
+    return True
 
+@command("history since", "history since", "history from")
+def cmd_history_since(cmd, mode):
+    # "history since yesterday", "history since last week searches"
+    kind, words = _history_kind(re.sub(r"^history\s+(?:since|from)\s*", "", cmd).split())
+    when = parse_since(" ".join(words))
+    if when is None:
+        respond(ENGINE, "I didn't understand that date. Try yesterday, last week, 3 days ago or 2025-01-31.")
+        return True
+    session = _SESSION.get()
+    start = time.perf_counter()
+    total, items = HISTORY.since(when.isoformat(" ", "seconds"), kind=kind,
+                                 session=session.id if session else None)
+    ms = (time.perf_counter() - start) * 1000
+    label = f"{kind} entries" if kind else "entries"
+    if not total:
+        respond(ENGINE, f"No {label} since {when.isoformat(' ', 'minutes')}.")
+        return True
+    respond(ENGINE, f"{total:,} {label} since {when.isoformat(' ', 'minutes')}." +
+            (f" Showing the newest {len(items)}." if total > len(items) else ""))
+    show_history_entries(items)
+    print(f"({ms:.1f} ms)")
+    return True
 
-    if "history" in cmd:
-        if os.path.exists(HISTORY_FILE):
-            with open(HISTORY_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            respond(ENGINE, f"I have {len(data)} history entries. Showing last 8.")
-            for item in data[-8:]:
-                print(item)
-        else:
-            respond(ENGINE, "No history found.")
+@command("history stats", "history stats", "history statistics", "history summary")
+def cmd_history_stats(cmd, mode):
+    stats = HISTORY.stats()
+    if not stats:
+        respond(ENGINE, "No history yet.")
         return True
+    total = sum(row["count"] for row in stats.values())
+    first = min(row["first"] for row in stats.values())
+    respond(ENGINE, f"{total:,} history entries since {first}; the most common is {next(iter(stats))}.")
+    print(f"{'type':<10} {'count':>10}  {'first':<19}  {'last':<19}")
+    for kind, row in stats.items():
+        print(f"{kind:<10} {row['count']:>10,}  {row['first']:<19}  {row['last']:<19}")
+    print(f"full-text search: {'FTS5' if HISTORY.fts else 'LIKE (no FTS5)'} — {HISTORY.path}")
+    return True
+
+@command("joke", "joke", "jokes")
+def cmd_joke(cmd, mode):
+    respond(ENGINE, random.choice(JOKES) + " " + random.choice(EMOJIS))
+    return True
+
+@command("fact", "fact", "facts")
+def cmd_fact(cmd, mode):
+    respond(ENGINE, random.choice(FUN_FACTS) + " " + random.choice(EMOJIS))
+    return True
 
+@command("search stats", "search stats", "search cache")
+def cmd_search_stats(cmd, mode):
+    show_search_cache_stats()
+    return True
 
-    if "joke" in cmd:
-        respond(ENGINE, random.choice(JOKES) + " " + random.choice(EMOJIS))
+@command("stats", "stats", "latency stats", "timing stats", "performance stats")
+def cmd_stats(cmd, mode):
+    # "stats" prints p50/p95/p99 per stage and command and saves them as JSON;
+    # "stats reset" clears the windows
+    if not METRICS.enabled:
+        respond(ENGINE, "Timing is turned off (LEXCHAT_METRICS=0).")
+        return True
+    if cmd.endswith("reset"):
+        METRICS.reset()
+        respond(ENGINE, "Timing stats cleared.")
+        return True
+    summary = METRICS.summary()
+    if not summary:
+        respond(ENGINE, "No timings recorded yet.")
         return True
+    print(f"{'stage':<10} {'command':<14} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for stage, kinds in summary.items():
+        for kind, row in kinds.items():
+            print(f"{stage:<10} {kind:<14} {row['count']:>6} {row['p50']:>9.1f} {row['p95']:>9.1f} {row['p99']:>9.1f}")
+    path = METRICS.export()
+    respond(ENGINE, f"Timing stats saved to {path}.")
+    return True
+
+@command("recognizer stats", "recognizer stats", "speech stats", "recognition stats")
+def cmd_recognizer_stats(cmd, mode):
+    respond(ENGINE, f"Speech recognition tries: {', '.join(b.name for b in recognizer_chain())}.")
+    show_recognizer_stats()
+    return True
 
+@command("last search", "last search", "previous search")
+def cmd_last_search(cmd, mode):
+    load_last_search()
+    return True
 
-    if "fact" in cmd:
-        respond(ENGINE, random.choice(FUN_FACTS) + " " + random.choice(EMOJIS))
+@command("local search", "local search", "offline search", "search offline", "search past results")
+def cmd_local_search(cmd, mode):
+    # BM25 over every result fetched so far; works offline and in headless mode
+    terms = re.sub(r"^(?:local\s+search|offline\s+search|search\s+offline|search\s+past\s+results)(?:\s+for)?\s*", "", cmd)
+    if not terms:
+        respond(ENGINE, "What should I look for in earlier results?")
+        terms = ask_input("Local search: ", mode=mode).strip()
+        if not terms:
+            return True
+    start = time.perf_counter()
+    index = local_index()
+    hits = index.search(terms)
+    ms = (time.perf_counter() - start) * 1000
+    total = index.count()
+    if not hits:
+        respond(ENGINE, f"Nothing about {terms} in the {total:,} results I've saved.")
         return True
+    respond(ENGINE, f"Best match for {terms} among {total:,} saved results: {hits[0][1].get('title') or 'an untitled page'}.")
+    for score, res in hits:
+        print_result(res)
+        print(f"   score {score:.2f}" + (f" · found searching \"{res['query']}\"" if res.get("query") else ""))
+    print(f"({ms:.1f} ms)")
+    save_history({"type":"search","query":terms,"local":True,"hits":len(hits),"time":now_str()})
+    return True
 
-    if "search" in cmd:
+@command("search", "search", "look up")
+def cmd_search(cmd, mode):
+    if headless_unavailable("Web search"):
+        return True
+    refresh = "refresh" in command_tokens(cmd)
+    # the query spoken with the command ("search numpy; pandas"), else ask for it
+    query = re.sub(r"(?:^|\s)-*refresh\b", " ", re.sub(r"^(?:search|look\s+up)(?:\s+for)?\b", "", cmd)).strip()
+    if not query:
         respond(ENGINE, "What should I search for?")
         query = ask_input("Search query: ", mode=mode)
-        if query:
-            search_web(query)
-        return True
-
-    if "last search" in cmd:
-        load_last_search()
-        return True
-
-    if "draw" in cmd or "turtle" in cmd:
-        respond(ENGINE, "Which shape would you like? (square, circle, triangle, star, heart, spiral, polygon:n, flower:n)")
-        shape_resp = ask_input("Shape: ", mode=mode) or "square"
-        shape = shape_resp.strip().lower()
-        respond(ENGINE, "What color?")
-        color = ask_input("Color: ", mode=mode) or "blue"
-        respond(ENGINE, "What size? (say a number)")
-        size_txt = ask_input("Size: ", mode=mode)
-        size = int(parse_number(size_txt) or 100)
-        respond(ENGINE, "What speed? (1 slow - 10 fast)")
-        speed_txt = ask_input("Speed: ", mode=mode)
-        speed = int(parse_number(speed_txt) or 5)
-        respond(ENGINE, f"Okay — drawing {shape} in {color} size {size} speed {speed}.")
-        t = threading.Thread(target=draw_shape, args=(shape,color,size,speed))
-        t.start()
-        save_history({"type":"draw","shape":shape,"color":color,"size":size,"speed":speed,"time":now_str()})
+    queries = split_queries(query)
+    if len(queries) > 1:
+        search_many(queries, refresh=refresh)
+    elif queries:
+        search_web(queries[0], refresh=refresh)
+    return True
+
+@command("draw", "draw", "turtle")
+def cmd_draw(cmd, mode):
+    respond(ENGINE, f"Which shape would you like? ({SHAPES_HELP})")
+    shape_resp = ask_input("Shape: ", mode=mode) or "square"
+    # "polygon 12" -> "polygon:12"
+    shape = re.sub(r"^(polygon|spiral|flower)\s+(?=\d)", r"\1:", shape_resp.strip().lower())
+    respond(ENGINE, "What color?")
+    color = ask_input("Color: ", mode=mode) or "blue"
+    respond(ENGINE, "What size? (say a number)")
+    size_txt = ask_input("Size: ", mode=mode)
+    size = min(max(int(parse_number(size_txt) or 100), 1), DRAW_MAX_SIZE)
+    respond(ENGINE, "What speed? (1 slow - 10 fast)")
+    speed_txt = ask_input("Speed: ", mode=mode)
+    speed = min(max(int(parse_number(speed_txt) or 5), 1), 10)
+    try:
+        shape_paths(shape, size)
+    except ValueError as e:
+        respond(ENGINE, str(e))
+        return True
+    except ImportError:
+        respond(ENGINE, "Drawing needs numpy, which isn't installed.")
         return True
+    if HEADLESS or _SESSION.get() is not None or not has_display():
+        path = offload("io", export_drawing, shape, color, size)
+        respond(ENGINE, f"There's no display here, so I saved the {shape} drawing to {path}.")
+    else:
+        respond(ENGINE, f"Okay — drawing {shape} in {color} size {size} speed {speed}.")
+        draw_shape(shape, color, size, speed)
+    save_history({"type":"draw","shape":shape,"color":color,"size":size,"speed":speed,"time":now_str()})
+    return True
+
+@command("code", "code", "generate code")
+def cmd_code(cmd, mode):
+    respond(ENGINE, "Which language? Python, HTML, or JavaScript?")
+    lang = ask_input("Language: ", mode=mode) or "python"
+    respond(ENGINE, "What kind of snippet? e.g., function, loop, basic, alert, class, form")
+    kind = ask_input("Kind: ", mode=mode) or "function"
+    respond(ENGINE, "Do you want me to save the snippet? say yes or no.")
+    save_ans = ask_input("Save? (yes/no): ", mode=mode).lower()
+    save_flag = save_ans.startswith("y")
+    filename = None
+    if save_flag:
+        suggested = f"snippet_{lang}_{int(time.time())}.{ 'py' if 'py' in lang else ('html' if 'html' in lang else 'js') }"
+        respond(ENGINE, f"Say filename or I will save as {suggested}.")
+        fn = ask_input("Filename (or enter to accept): ", mode=mode).strip()
+        filename = fn if fn else suggested
+    generate_code(lang, kind, save=save_flag, filename=filename)
+    return True
 
+_MATH_OPS = {
+    "add": "add", "plus": "add", "+": "add", "sum": "add",
+    "subtract": "subtract", "minus": "subtract", "-": "subtract",
+    "multiply": "multiply", "times": "multiply", "*": "multiply",
+    "divide": "divide", "/": "divide",
+    "power": "power", "pow": "power",
+    "factorial": "factorial", "sqrt": "sqrt", "prime": "prime",
+}
 
-    if "code" in cmd or "generate code" in cmd:
-        respond(ENGINE, "Which language? Python, HTML, or JavaScript?")
-        lang = ask_input("Language: ", mode=mode) or "python"
-        respond(ENGINE, "What kind of snippet? e.g., function, loop, basic, alert, class, form")
-        kind = ask_input("Kind: ", mode=mode) or "function"
-        respond(ENGINE, "Do you want me to save the snippet? say yes or no.")
-        save_ans = ask_input("Save? (yes/no): ", mode=mode).lower()
-        save_flag = save_ans.startswith("y")
-        filename = None
-        if save_flag:
-            suggested = f"snippet_{lang}_{int(time.time())}.{ 'py' if 'py' in lang else ('html' if 'html' in lang else 'js') }"
-            respond(ENGINE, f"Say filename or I will save as {suggested}.")
-            fn = ask_input("Filename (or enter to accept): ", mode=mode).strip()
-            filename = fn if fn else suggested
-        generate_code(lang, kind, save=save_flag, filename=filename)
+def calculate(text):
+    # answer a one-utterance expression; False when it needs the prompts
+    try:
+        value, expr = evaluate_expression(text)
+    except CalcIncomplete:
+        return False
+    except ZeroDivisionError:
+        respond(ENGINE, "Cannot divide by zero.")
         return True
+    except (ValueError, OverflowError, TypeError) as e:
+        logging.info("calc error for %r: %s", text, e)
+        respond(ENGINE, "That's outside what I can compute.")
+        return True
+    respond(ENGINE, f"{expr} = {format_number(value)}")
+    return True
 
-
-    if any(k in cmd for k in ["calc","calculator","math","compute","factorial","sqrt","prime"]):
+def math_prompts(mode, op=None, numbers=()):
+    # the step-by-step flow, skipping whatever the user already said
+    numbers = list(numbers)
+    if op is None:
         respond(ENGINE, "Math mode. Say operation: add, subtract, multiply, divide, power, factorial, sqrt, prime")
-        op = ask_input("Operation: ", mode=mode).lower()
-        if op in ("factorial","prime"):
-            val_txt = ask_input("Number: ", mode=mode)
-            val = parse_number(val_txt)
-            if val is None:
-                respond(ENGINE, "Couldn't parse that number.")
+        op = _MATH_OPS.get(ask_input("Operation: ", mode=mode).lower().strip())
+    if op in ("factorial","prime","sqrt"):
+        val = numbers[0] if numbers else parse_int(ask_input("Number: ", mode=mode))
+        if val is None:
+            respond(ENGINE, "Couldn't parse that number.")
+        elif op == "factorial":
+            try:
+                res = _factorial(int(val))
+                respond(ENGINE, f"Factorial of {int(val)} is {format_number(res)}")
+            except Exception:
+                respond(ENGINE, "Failed to compute factorial.")
+        elif op == "sqrt":
+            if val < 0:
+                respond(ENGINE, "I can't take the square root of a negative number.")
             else:
-                if op == "factorial":
-                    try:
-                        res = math.factorial(int(val))
-                        respond(ENGINE, f"Factorial of {int(val)} is {res}")
-                    except Exception:
-                        respond(ENGINE, "Failed to compute factorial.")
-                else:
-                    res = is_prime(int(val))
-                    respond(ENGINE, f"{int(val)} is {'a prime' if res else 'not a prime'}.")
+                respond(ENGINE, f"Square root of {val} is {format_number(math.sqrt(val))}")
         else:
-            a_txt = ask_input("First number: ", mode=mode)
-            b_txt = ask_input("Second number: ", mode=mode)
-            a = parse_number(a_txt); b = parse_number(b_txt)
-            if a is None or b is None:
-                respond(ENGINE, "Couldn't parse numbers.")
-            else:
-                if op in ("add","plus","+"):
-                    respond(ENGINE, f"Result: {a + b}")
-                elif op in ("subtract","minus","-"):
-                    respond(ENGINE, f"Result: {a - b}")
-                elif op in ("multiply","times","*"):
-                    respond(ENGINE, f"Result: {a * b}")
-                elif op in ("divide","/"):
-                    if b == 0:
-                        respond(ENGINE, "Cannot divide by zero.")
-                    else:
-                        respond(ENGINE, f"Result: {a / b}")
-                elif op in ("power","pow"):
-                    respond(ENGINE, f"Result: {a ** b}")
-                else:
-                    respond(ENGINE, "Operation not recognized.")
+            res = is_prime(int(val))
+            respond(ENGINE, f"{int(val)} is {'a prime' if res else 'not a prime'}.")
+        return True
+    if op is None:
+        respond(ENGINE, "Operation not recognized.")
         return True
+    while len(numbers) < 2:
+        numbers.append(parse_number(ask_input("First number: " if not numbers else "Second number: ", mode=mode)))
+    a, b = numbers[0], numbers[1]
+    if a is None or b is None:
+        respond(ENGINE, "Couldn't parse numbers.")
+    elif op == "add":
+        respond(ENGINE, f"Result: {format_number(a + b)}")
+    elif op == "subtract":
+        respond(ENGINE, f"Result: {format_number(a - b)}")
+    elif op == "multiply":
+        respond(ENGINE, f"Result: {format_number(a * b)}")
+    elif op == "divide":
+        if b == 0:
+            respond(ENGINE, "Cannot divide by zero.")
+        else:
+            respond(ENGINE, f"Result: {format_number(a / b)}")
+    elif op == "power":
+        try:
+            _check_result_size(ast.Pow(), a, b)
+            respond(ENGINE, f"Result: {format_number(a ** b)}")
+        except (OverflowError, ValueError):
+            respond(ENGINE, "That's outside what I can compute.")
+    return True
 
+def _partial_math(text):
+    # pull an operation word and any numbers out of an incomplete expression
+    words = normalize_expression(text).split()
+    op = next((_MATH_OPS[w] for w in words if w in _MATH_OPS), None)
+    numbers = [parse_int(w) if w.lstrip("-").isdigit() else float(w)
+               for w in words if re.fullmatch(r"-?\d+(?:\.\d+)?", w)]
+    return op, numbers
 
-    if "story" in cmd:
-        respond(ENGINE, "Let's make a short story! Give me a verb, a noun, and an adjective.")
-        w1 = ask_input("Verb: ", mode=mode)
-        w2 = ask_input("Noun: ", mode=mode)
-        w3 = ask_input("Adjective: ", mode=mode)
-        story = f"Once upon a time, a brave soul decided to {w1} the {w2}. Everything turned {w3 or 'strange'}, and they found something unexpected."
-        respond(ENGINE, story, pause=0.6)
-        save_history({"type":"story","words":[w1,w2,w3],"time":now_str()})
-        return True
+_ORDINAL_WORD = re.compile(r"\b(?:nth|\d+(?:st|nd|rd|th)|" + "|".join(_ORDINALS) + r")\b")
+_ORDINAL_PRIME = re.compile(r"\b(?:nth|\d+(?:st|nd|rd|th)|" + "|".join(_ORDINALS) + r")\s+prime\b")
+_CALC_OPERATOR = re.compile(r"[-+*/%()=]")
 
+def is_ordinal_prime(text):
+    # "97th prime", "the nth prime", "twenty first prime number"
+    return _ORDINAL_PRIME.search(text.lower()) is not None
 
-    if "weight" in cmd:
-        wt_txt = ask_input("Enter weight: ", mode=mode)
-        wt = parse_number(wt_txt)
-        if wt is None:
-            respond(ENGINE, "Couldn't parse weight.")
-            return True
-        unit = ask_input("Unit (K for kg / L for lbs): ", mode=mode).upper()
-        if unit == "K":
-            respond(ENGINE, f"{wt * 2.205:.2f} pounds")
-        else:
-            respond(ENGINE, f"{wt / 2.205:.2f} kilograms")
+@command("math", "calc", "calculate", "calculator", "math", "compute", "factorial", "sqrt", "prime",
+         when=lambda text: not is_ordinal_prime(text))
+def cmd_math(cmd, mode):
+    if calculate(cmd):
         return True
+    op, numbers = _partial_math(cmd)
+    return math_prompts(mode, op, numbers)
 
-    if "temp" in cmd or "temperature" in cmd:
-        t_txt = ask_input("Enter temperature: ", mode=mode)
-        tv = parse_number(t_txt)
-        if tv is None:
-            respond(ENGINE, "Couldn't parse temperature.")
-            return True
-        unit = ask_input("Unit (C/F): ", mode=mode).upper()
-        if unit == "C":
-            respond(ENGINE, f"{(9*tv)/5 + 32:.1f} °F")
-        else:
-            respond(ENGINE, f"{(tv-32)*5/9:.1f} °C")
+def looks_like_calculation(text):
+    # "what is" / "how much is" only mean maths when there is something to
+    # compute: an operator, a number that isn't an ordinal, or a known name
+    expr = normalize_expression(text)
+    if _CALC_OPERATOR.search(expr):
+        return True
+    if _ORDINAL_WORD.search(text.lower()):
+        return False   # "what is the 5th prime number"
+    env = _SESSION.get().calc_vars if _SESSION.get() is not None else CALC_VARS
+    return bool(re.search(r"\d", expr)) or expr in _CALC_CONSTS or expr in env
+
+@command("calculate", "what is", "what's", "how much is", "evaluate", when=looks_like_calculation)
+def cmd_calculate(cmd, mode):
+    if calculate(cmd):
         return True
+    op, numbers = _partial_math(cmd)
+    if op is None and not numbers:
+        respond(ENGINE, "Sorry, I didn't quite catch that. Say 'help' to hear commands.")
+        return True
+    return math_prompts(mode, op, numbers)
 
+def _number_arg(cmd, trigger, prompt, mode):
+    # the number spoken with the command ("next prime after 100"), else ask for it
+    rest = " ".join(w for w in cmd.split() if w not in trigger)
+    val = parse_int(rest) if rest else None
+    if val is None:
+        val = parse_int(ask_input(prompt, mode=mode))
+    return val
 
-    if "game" in cmd or "rps" in cmd or "rock" in cmd:
-        respond(ENGINE, "Let's play rock, paper, scissors! Say rock, paper, or scissors.")
-        choice = ask_input("Your choice: ", mode=mode).lower()
-        ai_choice = random.choice(["rock","paper","scissors"])
-        respond(ENGINE, f"I choose {ai_choice}.")
-        if choice == ai_choice:
-            respond(ENGINE, "It's a tie!")
-        elif (choice=="rock" and ai_choice=="scissors") or (choice=="paper" and ai_choice=="rock") or (choice=="scissors" and ai_choice=="paper"):
-            respond(ENGINE, "You win! 🎉")
-        else:
-            respond(ENGINE, "I win! 😜")
+@command("next prime", "next prime", "prime after")
+def cmd_next_prime(cmd, mode):
+    n = _number_arg(cmd, ("next", "first", "prime", "after", "the"), "After which number? ", mode)
+    if n is None:
+        respond(ENGINE, "Couldn't parse that number.")
+    else:
+        respond(ENGINE, f"The next prime after {n} is {next_prime(n)}.")
+    return True
+
+@command("nth prime", "nth prime", "prime number", "prime", when=is_ordinal_prime)
+def cmd_nth_prime(cmd, mode):
+    m = _ORDINAL_PRIME.search(cmd)
+    if m and not m.group().startswith("nth"):
+        # the ordinal with any number words before it: "twenty first prime" -> 21
+        k = parse_int(cmd[:m.end() - len("prime")])
+    else:
+        k = _number_arg(cmd, ("nth", "prime", "number", "the", "th", "st", "nd", "rd"), "Which one (n)? ", mode)
+    if k is None or k < 1:
+        respond(ENGINE, "Give me a whole number of at least 1.")
+    elif k > NTH_PRIME_MAX:
+        respond(ENGINE, f"That's too far; I can find primes up to number {NTH_PRIME_MAX:,}.")
+    else:
+        respond(ENGINE, f"Prime number {k:,} is {offload('cpu', nth_prime, k):,}.")
+    return True
+
+@command("count primes", "count primes", "primes up to", "how many primes")
+def cmd_count_primes(cmd, mode):
+    n = _number_arg(cmd, ("count", "primes", "up", "to", "how", "many", "below", "under"), "Up to which number? ", mode)
+    if n is None:
+        respond(ENGINE, "Couldn't parse that number.")
+    elif n > COUNT_PRIMES_MAX:
+        respond(ENGINE, f"I can count primes up to {COUNT_PRIMES_MAX:,}.")
+    else:
+        respond(ENGINE, f"There are {offload('cpu', count_primes, n):,} primes up to {n:,}.")
+    return True
+
+@command("factor", "factor", "factorize", "factorise", "prime factors")
+def cmd_factor(cmd, mode):
+    n = _number_arg(cmd, ("factor", "factorize", "factorise", "prime", "factors", "of"), "Number to factor: ", mode)
+    if n is None or n < 2:
+        respond(ENGINE, "Give me a whole number of at least 2.")
+    elif n >= 10 ** FACTOR_MAX_DIGITS:
+        respond(ENGINE, f"I can factor numbers of up to {FACTOR_MAX_DIGITS} digits.")
+    else:
+        factors, unsplit = offload("cpu", factorize, n)
+        text = f"{n} = {' × '.join(str(f) for f in factors + unsplit)}"
+        if unsplit == [n]:
+            text = f"{n} isn't prime, but I couldn't find its factors in time."
+        elif unsplit:
+            text += f", but I couldn't split {' or '.join(str(f) for f in unsplit)} any further in time."
+        elif len(factors) == 1:
+            text += " (prime)"
+        respond(ENGINE, text)
+    return True
+
+@command("story", "story")
+def cmd_story(cmd, mode):
+    respond(ENGINE, "Let's make a short story! Give me a verb, a noun, and an adjective.")
+    w1 = ask_input("Verb: ", mode=mode)
+    w2 = ask_input("Noun: ", mode=mode)
+    w3 = ask_input("Adjective: ", mode=mode)
+    story = f"Once upon a time, a brave soul decided to {w1} the {w2}. Everything turned {w3 or 'strange'}, and they found something unexpected."
+    respond(ENGINE, story, pause=0.6)
+    save_history({"type":"story","words":[w1,w2,w3],"time":now_str()})
+    return True
+
+@command("weight", "weight")
+def cmd_weight(cmd, mode):
+    wt_txt = ask_input("Enter weight: ", mode=mode)
+    wt = parse_number(wt_txt)
+    if wt is None:
+        respond(ENGINE, "Couldn't parse weight.")
         return True
+    unit = ask_input("Unit (K for kg / L for lbs): ", mode=mode).upper()
+    if unit == "K":
+        respond(ENGINE, f"{wt * 2.205:.2f} pounds")
+    else:
+        respond(ENGINE, f"{wt / 2.205:.2f} kilograms")
+    return True
 
+@command("temperature", "temp", "temperature")
+def cmd_temperature(cmd, mode):
+    t_txt = ask_input("Enter temperature: ", mode=mode)
+    tv = parse_number(t_txt)
+    if tv is None:
+        respond(ENGINE, "Couldn't parse temperature.")
+        return True
+    unit = ask_input("Unit (C/F): ", mode=mode).upper()
+    if unit == "C":
+        respond(ENGINE, f"{(9*tv)/5 + 32:.1f} °F")
+    else:
+        respond(ENGINE, f"{(tv-32)*5/9:.1f} °C")
+    return True
 
-    if any(k in cmd for k in ["list","tuple","set"]):
-        respond(ENGINE, "Which type? list, tuple, or set?")
-        typ = ask_input("Type: ", mode=mode).lower()
-        if typ == "list":
-            print(["apple","banana","orange","mango"])
-        elif typ == "tuple":
-            print(("dog","cat","bird","gorilla"))
-        elif typ == "set":
-            print({"toyota","bmw","rolls royce","land rover"})
-        else:
-            respond(ENGINE, "Unknown type.")
+@command("game", "game", "rps", "rock paper scissors", "rock")
+def cmd_game(cmd, mode):
+    respond(ENGINE, "Let's play rock, paper, scissors! Say rock, paper, or scissors.")
+    choice = ask_input("Your choice: ", mode=mode).lower()
+    ai_choice = random.choice(["rock","paper","scissors"])
+    respond(ENGINE, f"I choose {ai_choice}.")
+    if choice == ai_choice:
+        respond(ENGINE, "It's a tie!")
+    elif (choice=="rock" and ai_choice=="scissors") or (choice=="paper" and ai_choice=="rock") or (choice=="scissors" and ai_choice=="paper"):
+        respond(ENGINE, "You win! 🎉")
+    else:
+        respond(ENGINE, "I win! 😜")
+    return True
+
+@command("lists", "list", "lists", "tuple", "tuples", "set", "sets")
+def cmd_lists(cmd, mode):
+    respond(ENGINE, "Which type? list, tuple, or set?")
+    typ = ask_input("Type: ", mode=mode).lower()
+    if typ == "list":
+        print(["apple","banana","orange","mango"])
+    elif typ == "tuple":
+        print(("dog","cat","bird","gorilla"))
+    elif typ == "set":
+        print({"toyota","bmw","rolls royce","land rover"})
+    else:
+        respond(ENGINE, "Unknown type.")
+    return True
+
+
+def execute_command(command, mode="text"):
+    own_turn = METRICS.begin_turn()
+    try:
+        with METRICS.span("dispatch"):
+            try:
+                return _dispatch(command, mode)
+            except ImportError as e:
+                # a missing optional package only disables the command that needs it
+                respond(ENGINE, f"That needs {_PIP_NAMES.get(e.name, e.name or 'a package')}, which isn't installed.")
+                return True
+    finally:
+        if own_turn:
+            METRICS.end_turn()
+
+def _dispatch(command, mode):
+    cmd = (command or "").strip().lower()
+    logging.info("CMD: %s (mode=%s)", cmd, mode)
+    save_history({"type":"command","cmd":cmd,"mode":mode,"time":now_str()})
+
+    if cmd == "":
         return True
 
+    name, handler = route(cmd)
+    if handler:
+        METRICS.set_kind(name)
+        return handler(cmd, mode)
 
-    fallback = fuzzy_intent(cmd, cutoff=0.45)
-    if fallback:
+    fallback, confidence = fuzzy_intent_scored(cmd)
+    if fallback and confidence >= FUZZY_CUTOFF:
+        METRICS.set_kind(fallback)
+        logging.info("fuzzy intent %s (%.2f) for %r", fallback, confidence, cmd)
         respond(ENGINE, f"It sounds like you meant: {fallback}. I'll try that.")
-        return execute_command(fallback, mode)
+        return COMMAND_HANDLERS[fallback](fallback, mode)
 
+    METRICS.set_kind("unknown")
     respond(ENGINE, "Sorry, I didn't quite catch that. Say 'help' to hear commands.")
     return True
 
 
-def main():
-    respond(ENGINE, "Welcome,  I'm, Lexchat, Say 'voice' to use voice or 'text' to type commands.")
+class BatchTurn:
+    # one scripted command: hands out its pre-supplied answers to ask_input
+    # in order and records what the assistant said and asked
+    def __init__(self, answers=None):
+        self.answers = collections.deque(str(a) for a in (answers or []))
+        self.prompts = []
+        self.said = []
+
+    def answer(self, prompt):
+        self.prompts.append(prompt.strip())
+        return self.answers.popleft() if self.answers else ""
+
+
+_BATCH_TURN = None
+
+def run_batch_command(command, answers=None):
+    global _BATCH_TURN
+    turn = BatchTurn(answers)
+    printed = io.StringIO()
+    error = None
+    cont = True
+    _BATCH_TURN = turn
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(printed):
+            cont = execute_command(command, mode="text")
+    except Exception as e:
+        logging.error("batch command %r failed: %s", command, e)
+        error = f"{type(e).__name__}: {e}"
+    finally:
+        _BATCH_TURN = None
+    elapsed = (time.perf_counter() - start) * 1000
+    cmd = (command or "").strip().lower()
+    return {
+        "command": command,
+        "intent": route(cmd)[0] or fuzzy_intent(cmd),
+        "ok": error is None,
+        "error": error,
+        "continue": cont,
+        "elapsed_ms": round(elapsed, 3),
+        "said": turn.said,
+        "prompts": turn.prompts,
+        "unused_answers": list(turn.answers),
+        "printed": printed.getvalue(),
+    }
+
+def run_batch(script, out=None):
+    # Replays a JSONL script, one {"command": ..., "answers": [...]} per line,
+    # with speech off, writing one JSON result per command. Exit commands are
+    # recorded ("continue": false) but do not stop the run.
+    ENGINE.enabled = False
+    try:
+        src = sys.stdin if script == "-" else open(script, "r", encoding="utf-8")
+    except OSError as e:
+        print(f"batch: can't read {script}: {e.strerror or e}", file=sys.stderr)
+        return False
+    try:
+        dst = sys.stdout if out in (None, "-") else open(out, "w", encoding="utf-8")
+    except OSError as e:
+        print(f"batch: can't write {out}: {e.strerror or e}", file=sys.stderr)
+        if src is not sys.stdin:
+            src.close()
+        return False
+    count = 0
+    failed = 0
+    start = time.perf_counter()
+    try:
+        for lineno, line in enumerate(src, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError as e:
+                result = {"line": lineno, "ok": False, "error": f"bad JSON: {e}"}
+            else:
+                if isinstance(item, str):
+                    item = {"command": item}
+                if not isinstance(item, dict):
+                    result = {"line": lineno, "ok": False,
+                              "error": f"expected an object or a string, got {type(item).__name__}"}
+                elif not isinstance(item.get("command", ""), str) or not isinstance(item.get("answers") or [], list):
+                    result = {"line": lineno, "ok": False, "error": "command must be a string and answers a list"}
+                else:
+                    result = {"line": lineno, **run_batch_command(item.get("command", ""), item.get("answers"))}
+            count += 1
+            failed += 0 if result["ok"] else 1
+            dst.write(json.dumps(result, ensure_ascii=False) + "\n")
+            dst.flush()
+    finally:
+        if src is not sys.stdin:
+            src.close()
+        if dst is not sys.stdout:
+            dst.close()
+    total = time.perf_counter() - start
+    print(f"batch: {count} commands, {failed} failed, {total:.2f}s total, "
+          f"{(total / count * 1000) if count else 0:.2f} ms/command", file=sys.stderr)
+    return failed == 0
+
+
+# ---- server mode ----
+# `--serve` runs many text sessions at once behind a small JSON-over-HTTP
+# endpoint on localhost. Command handlers stay synchronous: each command runs
+# on a thread from the session pool with the session bound in _SESSION, and
+# respond/ask_input/history/voice/calculator state resolve through it. When a
+# handler asks a question the reply goes back to the client with the prompt;
+# the client's next message is the answer. Network and disk work goes to a
+# bounded I/O pool and heavy number theory to a process pool.
+#   POST /sessions                {"voice": "calm"}   -> {"session": id, ...}
+#   POST /sessions/<id>           {"text": "..."}     -> {"said", "printed", "prompt", "continue", ...}
+#   GET  /sessions/<id>           waits for a reply that came back "pending"
+#   GET  /sessions/<id>/history                       -> {"history": [...]}
+#   DELETE /sessions/<id>
+#   GET  /health, GET /stats
+SERVER_HOST = os.environ.get("LEXCHAT_SERVER_HOST", "127.0.0.1")
+SERVER_PORT = int(os.environ.get("LEXCHAT_SERVER_PORT", "8765"))
+SERVER_MAX_SESSIONS = 512
+SERVER_IO_WORKERS = 16            # concurrent searches / drawing exports
+SERVER_CPU_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+SERVER_REPLY_TIMEOUT = 60.0       # a request returns "pending" after this long
+SERVER_ANSWER_TIMEOUT = 300.0     # an unanswered prompt is given "" after this long
+SERVER_SESSION_IDLE = 30 * 60     # idle sessions are dropped after this many seconds
+SERVER_MAX_BODY = 64 * 1024
+
+_SESSION = contextvars.ContextVar("lexchat_session", default=None)
+_POOLS = {}    # "io" / "cpu" executors, only while serving
+
+def current_session():
+    return _SESSION.get()
+
+def offload(pool, fn, *args):
+    # run blocking work on a server pool; inline outside server sessions
+    executor = _POOLS.get(pool) if _SESSION.get() is not None else None
+    if executor is None:
+        return fn(*args)
+    return executor.submit(fn, *args).result()
+
+
+class Session:
+    # Per-client state. The asyncio side calls send(); the handler thread
+    # talks back through ask() and _signal().
+    def __init__(self, server, sid, voice_mode=DEFAULT_VOICE_MODE):
+        self.server = server
+        self.id = sid
+        self.voice_mode = voice_mode
+        self.calc_vars = {}
+        self.last_search = None
+        self.local_index = LocalIndex(None)
+        self.prompt = None           # set while a handler waits in ask()
+        self.running = False
+        self.closed = False
+        self.last_seen = time.monotonic()
+        self._answers = queue.Queue()
+        self._said = []
+        self._printed = io.StringIO()
+        self._out_lock = threading.Lock()
+        self._lock = None
+        self._reply = None
+
+    def say(self, text):
+        with self._out_lock:
+            self._said.append(text)
+
+    def write(self, text):
+        with self._out_lock:
+            return self._printed.write(text)
+
+    def ask(self, prompt):
+        self.prompt = prompt.strip()
+        self._signal("prompt", self.prompt)
+        try:
+            return self._answers.get(timeout=SERVER_ANSWER_TIMEOUT)
+        except queue.Empty:
+            logging.info("session %s: no answer to %r", self.id, self.prompt)
+            return ""
+        finally:
+            self.prompt = None
+
+    def _signal(self, kind, value):
+        self.server.loop.call_soon_threadsafe(self._resolve, kind, value)
+
+    def _resolve(self, kind, value):
+        if self._reply is not None and not self._reply.done():
+            self._reply.set_result((kind, value))
+
+    def _run(self, text):
+        token = _SESSION.set(self)
+        cont = True
+        try:
+            cont = execute_command(text, mode="text")
+        except Exception as e:
+            logging.error("session %s: command %r failed: %s", self.id, text, e)
+            self.say("Sorry, something went wrong with that command.")
+        finally:
+            _SESSION.reset(token)
+            self.running = False
+            self._signal("done", cont)
+
+    def _drain(self):
+        with self._out_lock:
+            said, self._said = self._said, []
+            printed, self._printed = self._printed.getvalue(), io.StringIO()
+        return said, printed
+
+    async def send(self, text):
+        import asyncio
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self.prompt is None and self.running:
+                return 409, {"error": "still working on the previous command; GET to wait for it", "pending": True}
+            self._reply = self.server.loop.create_future()
+            if self.prompt is not None:
+                self._answers.put(text)
+            else:
+                self.running = True
+                self.server.pools["session"].submit(self._run, text)
+            return await self._wait_reply()
+
+    async def poll(self):
+        # collects the outcome of a command whose reply came back "pending"
+        import asyncio
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._reply is None:
+                return 200, {"session": self.id, "said": [], "printed": "", "prompt": self.prompt,
+                             "pending": False, "continue": True}
+            return await self._wait_reply()
+
+    async def _wait_reply(self):
+        import asyncio
+        self.last_seen = time.monotonic()
+        start = time.perf_counter()
+        try:
+            kind, value = await asyncio.wait_for(asyncio.shield(self._reply), SERVER_REPLY_TIMEOUT)
+        except asyncio.TimeoutError:
+            kind, value = "pending", None
+        elapsed = (time.perf_counter() - start) * 1000
+        METRICS.record("request", elapsed, kind="server")
+        said, printed = self._drain()
+        cont = value if kind == "done" else True
+        if not cont:
+            self.server.close_session(self.id)
+        return 200, {"session": self.id, "said": said, "printed": printed,
+                     "prompt": value if kind == "prompt" else None,
+                     "pending": kind == "pending", "continue": cont,
+                     "voice": {"mode": self.voice_mode, **voice_profiles().get(self.voice_mode, {})},
+                     "elapsed_ms": round(elapsed, 3)}
+
+
+class _SessionStdout:
+    # while serving, print() inside a session lands in that session's reply
+    def __init__(self, real):
+        self.real = real
+
+    def write(self, text):
+        session = _SESSION.get()
+        return session.write(text) if session is not None else self.real.write(text)
+
+    def flush(self):
+        self.real.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.real, name)
+
+
+class LexchatServer:
+    def __init__(self, host=SERVER_HOST, port=SERVER_PORT, max_sessions=SERVER_MAX_SESSIONS):
+        self.host = host
+        self.port = port
+        self.max_sessions = max_sessions
+        self.sessions = {}
+        self.pools = {}
+        self.loop = None
+        self.started = time.monotonic()
+        self.requests = 0
+
+    def _start_pools(self):
+        cf = importlib.import_module("concurrent.futures")
+        # every session may hold a thread while it waits for an answer
+        self.pools["session"] = cf.ThreadPoolExecutor(self.max_sessions, thread_name_prefix="session")
+        self.pools["io"] = cf.ThreadPoolExecutor(SERVER_IO_WORKERS, thread_name_prefix="server-io")
+        try:
+            self.pools["cpu"] = cf.ProcessPoolExecutor(SERVER_CPU_WORKERS)
+            self.pools["cpu"].submit(int, 0).result()   # fork the workers before the server's threads start
+        except (OSError, NotImplementedError) as e:
+            logging.warning("no process pool (%s); heavy math runs on session threads", e)
+            self.pools.pop("cpu", None)
+        _POOLS.update(self.pools)
+
+    def _stop_pools(self):
+        _POOLS.clear()
+        # wake every session thread still waiting for an answer
+        for sid in list(self.sessions):
+            self.close_session(sid)
+        for name, pool in self.pools.items():
+            # join the worker processes so none is left running without a parent
+            pool.shutdown(wait=name == "cpu", cancel_futures=True)
+
+    def create_session(self, voice_mode=None):
+        if len(self.sessions) >= self.max_sessions:
+            return 503, {"error": f"too many sessions (max {self.max_sessions})"}
+        voice_mode = (voice_mode or DEFAULT_VOICE_MODE).lower()
+        if voice_mode not in voice_profiles():
+            return 400, {"error": f"unknown voice mode; use {', '.join(voice_profiles())}"}
+        sid = os.urandom(8).hex()
+        self.sessions[sid] = Session(self, sid, voice_mode)
+        logging.info("session %s opened (%d active)", sid, len(self.sessions))
+        return 201, {"session": sid, "voice": voice_mode}
+
+    def close_session(self, sid):
+        session = self.sessions.pop(sid, None)
+        if session is not None:
+            session.closed = True
+            if session.prompt is not None:
+                session._answers.put("")
+        return session is not None
+
+    async def handle(self, method, target, body):
+        self.requests += 1
+        parts = [p for p in target.split("?", 1)[0].split("/") if p]
+        try:
+            data = json.loads(body) if body else {}
+        except ValueError:
+            return 400, {"error": "body must be JSON"}
+        if not isinstance(data, dict):
+            return 400, {"error": "body must be a JSON object"}
+        if parts == ["health"] and method == "GET":
+            return 200, {"ok": True, "sessions": len(self.sessions), "requests": self.requests,
+                         "uptime": round(time.monotonic() - self.started, 1)}
+        if parts == ["stats"] and method == "GET":
+            return 200, {"sessions": len(self.sessions), "stages": METRICS.summary()}
+        if parts == ["sessions"] and method == "POST":
+            return self.create_session(data.get("voice"))
+        if len(parts) < 2 or parts[0] != "sessions":
+            return 404, {"error": "not found"}
+        session = self.sessions.get(parts[1])
+        if session is None:
+            return 404, {"error": "no such session"}
+        if len(parts) == 2 and method == "POST":
+            return await session.send(str(data.get("text", "")))
+        if len(parts) == 2 and method == "GET":
+            return await session.poll()
+        if len(parts) == 2 and method == "DELETE":
+            self.close_session(session.id)
+            return 200, {"closed": session.id}
+        if parts[2:] == ["history"] and method == "GET":
+            import asyncio
+            loop = asyncio.get_running_loop()
+            history = await loop.run_in_executor(self.pools["io"], lambda: HISTORY.tail(None, session=session.id))
+            return 200, {"history": history}
+        return 404, {"error": "not found"}
+
+    async def _client(self, reader, writer):
+        http = importlib.import_module("http")
+        try:
+            while True:
+                line = await reader.readline()
+                if not line.strip():
+                    break
+                method, target = line.decode("latin-1").split()[:2]
+                headers = {}
+                while True:
+                    h = await reader.readline()
+                    if h in (b"\r\n", b"\n", b""):
+                        break
+                    key, _, value = h.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+                length = int(headers.get("content-length") or 0)
+                if length > SERVER_MAX_BODY:
+                    status, payload, keep = 413, {"error": "body too large"}, False
+                else:
+                    body = await reader.readexactly(length) if length else b""
+                    keep = headers.get("connection", "").lower() != "close"
+                    try:
+                        status, payload = await self.handle(method.upper(), target, body)
+                    except Exception as e:
+                        logging.error("server error on %s %s: %s", method, target, e)
+                        status, payload = 500, {"error": "internal error"}
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                writer.write((f"HTTP/1.1 {status} {http.HTTPStatus(status).phrase}\r\n"
+                              f"Content-Type: application/json; charset=utf-8\r\n"
+                              f"Content-Length: {len(data)}\r\n"
+                              f"Connection: {'keep-alive' if keep else 'close'}\r\n\r\n").encode("latin-1") + data)
+                await writer.drain()
+                if not keep:
+                    break
+        except (ConnectionError, ValueError, EOFError) as e:
+            logging.debug("client dropped: %s", e)
+        finally:
+            writer.close()
+
+    async def _reap(self):
+        import asyncio
+        while True:
+            await asyncio.sleep(60)
+            cutoff = time.monotonic() - SERVER_SESSION_IDLE
+            for sid in [sid for sid, s in self.sessions.items() if s.last_seen < cutoff and not s.running]:
+                logging.info("session %s expired", sid)
+                self.close_session(sid)
+
+    async def serve(self, ready=None):
+        import asyncio
+        self.loop = asyncio.get_running_loop()
+        server = await asyncio.start_server(self._client, self.host, self.port, backlog=1024)
+        self.port = server.sockets[0].getsockname()[1]
+        reaper = asyncio.create_task(self._reap())
+        # SIGTERM stops the server like Ctrl+C does, so serve() still shuts
+        # the pools down and no process-pool worker outlives it
+        stop = asyncio.Event()
+        with contextlib.suppress(NotImplementedError, AttributeError):
+            self.loop.add_signal_handler(signal.SIGTERM, stop.set)
+        print(f"Lexchat server on http://{self.host}:{self.port} (Ctrl+C to stop)", flush=True)
+        if ready is not None:
+            ready.set()
+        try:
+            async with server:
+                await stop.wait()
+        finally:
+            reaper.cancel()
+
+def serve(host=SERVER_HOST, port=SERVER_PORT):
+    # speech stays off: replies carry the text and the session's voice profile
+    import asyncio
+    ENGINE.enabled = False
+    server = LexchatServer(host, port)
+    server._start_pools()
+    real_stdout, sys.stdout = sys.stdout, _SessionStdout(sys.stdout)
+    try:
+        asyncio.run(server.serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sys.stdout = real_stdout
+        server._stop_pools()
+        HISTORY.close()
+
+
+# said the same way on every run: rendered to audio once per voice profile
+STATIC_PHRASES = [
+    "Listening...",
+    f"Recording for {VOICE_RECORD_SECONDS} seconds...",
+    "Finished recording.",
+    "I didn't hear anything.",
+    "I couldn't understand that audio.",
+    "Please type 'voice', 'text' or 'wake'.",
+    f"Hands-free mode. Say '{WAKE_WORD}' and then your command.",
+    "Sorry, I didn't quite catch that. Say 'help' to hear commands.",
+    "Here are things you can ask me. I'll also print them to console.",
+    "What should I search for?",
+    "Search results complete.",
+    f"Which shape would you like? ({SHAPES_HELP})",
+    "What color?",
+    "What size? (say a number)",
+    "What speed? (1 slow - 10 fast)",
+    "Which language? Python, HTML, or JavaScript?",
+    "What kind of snippet? e.g., function, loop, basic, alert, class, form",
+    "Do you want me to save the snippet? say yes or no.",
+    "I generated the snippet and will explain it briefly.",
+    "Math mode. Say operation: add, subtract, multiply, divide, power, factorial, sqrt, prime",
+    "Couldn't parse that number.",
+    "Let's make a short story! Give me a verb, a noun, and an adjective.",
+    "Let's play rock, paper, scissors! Say rock, paper, or scissors.",
+    "Which type? list, tuple, or set?",
+]
+
+def run_hands_free(source=None):
+    # -> False when an exit command ended the session
+    global WAKE_LISTENER
+    try:
+        WAKE_LISTENER = WakeListener(source).start()
+    except RecognizerUnavailable as e:
+        logging.warning("hands-free unavailable: %s", e)
+        respond(ENGINE, "Hands-free mode needs Vosk or pocketsphinx installed to listen for the wake word offline.")
+        return True
+    respond(ENGINE, f"Hands-free mode. Say '{WAKE_WORD}' and then your command.")
+    try:
+        while True:
+            try:
+                cmd = WAKE_LISTENER.commands.get(timeout=0.5)
+            except queue.Empty:
+                if WAKE_LISTENER.finished.is_set():
+                    return True
+                continue
+            print("-> (hands-free):", cmd)
+            ENGINE.cancel()
+            if not execute_command(cmd, mode="wake"):
+                return False
+    finally:
+        WAKE_LISTENER.stop()
+        WAKE_LISTENER = None
+
+def main(headless=False, wake=False):
+    global HEADLESS
+    HEADLESS = HEADLESS or headless
+    ENGINE.enabled = not HEADLESS
+    ENGINE.warm(STATIC_PHRASES)
+    if not HEADLESS:
+        warm_recognizers()
+    # the local search corpus loads in the background so the first search doesn't wait
+    threading.Thread(target=LOCAL_INDEX.count, name="local-index", daemon=True).start()
+    if HEADLESS:
+        respond(ENGINE, "Welcome, I'm Lexchat. Text mode only; say 'help' to see commands.")
+    else:
+        respond(ENGINE, "Welcome,  I'm, Lexchat, Say 'voice' to use voice or 'text' to type commands.")
     while True:
-        mode = input("Mode (voice/text/quit): ").strip().lower()
+        if HEADLESS:
+            mode = "text"
+        else:
+            mode = "wake" if wake else input("Mode (voice/text/wake/quit): ").strip().lower()
+            wake = False
         if mode in ("quit","exit"):
             respond(ENGINE, "Goodbye Sirs or Madams 🫣. Take care!")
+            ENGINE.wait_idle(timeout=5)
             break
+        if mode == "wake":
+            if not run_hands_free():
+                ENGINE.wait_idle(timeout=5)
+                break
+            continue
         if mode not in ("voice","text"):
-            respond(ENGINE, "Please type 'voice' or 'text'.")
+            respond(ENGINE, "Please type 'voice', 'text' or 'wake'.")
             continue
 
         if mode == "voice":
-            filename = record_audio(duration=VOICE_RECORD_SECONDS)
-            if not filename:
+            # a voice turn is timed as a whole, from microphone to dispatch
+            METRICS.begin_turn()
+            try:
+                with METRICS.span("turn"):
+                    audio = record_audio(duration=VOICE_RECORD_SECONDS)
+                    cmd = recognize_audio(audio) if audio is not None else ""
+                    if cmd:
+                        ENGINE.cancel()
+                        cont = execute_command(cmd, mode=mode)
+            finally:
+                METRICS.end_turn()
+            if not cmd:
                 continue
-            cmd = recognize_file(filename)
         else:
             cmd = input("Enter command: ")
-
-        if not cmd:
-            continue
-        cont = execute_command(cmd, mode=mode)
+            if not cmd:
+                continue
+            # barge-in: a new command silences whatever is still queued
+            ENGINE.cancel()
+            cont = execute_command(cmd, mode=mode)
         if not cont:
+            ENGINE.wait_idle(timeout=5)
             break
 
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Lexchat assistant")
+    parser.add_argument("--headless", action="store_true",
+                        help="text-only REPL: no speech, microphone or web search; drawings are saved as SVG")
+    parser.add_argument("--batch", metavar="SCRIPT",
+                        help="run a JSONL script of commands ('-' for stdin) and exit")
+    parser.add_argument("--out", metavar="FILE", help="where --batch writes JSONL results (default stdout)")
+    parser.add_argument("--serve", action="store_true",
+                        help="serve concurrent text sessions over HTTP on localhost (see loadtest.py)")
+    parser.add_argument("--host", default=SERVER_HOST, help=f"--serve address (default {SERVER_HOST})")
+    parser.add_argument("--port", type=int, default=SERVER_PORT, help=f"--serve port (default {SERVER_PORT}, 0 picks a free one)")
+    parser.add_argument("--wake", action="store_true",
+                        help=f"start hands-free: listen continuously for '{WAKE_WORD}' followed by a command")
+    parser.add_argument("--wake-file", metavar="WAV",
+                        help="replay a WAV through the hands-free listener, print the commands heard and exit")
+    parser.add_argument("--stats", metavar="FILE", help="after --batch, write the stage timings to FILE as JSON")
+    args = parser.parse_args()
+    if args.serve:
+        HEADLESS = HEADLESS or args.headless
+        serve(args.host, args.port)
+        sys.exit(0)
+    if args.wake_file:
+        try:
+            for heard in wake_commands_from_wav(args.wake_file):
+                print(heard)
+        except RecognizerUnavailable as e:
+            sys.exit(f"--wake-file: {e}")
+        sys.exit(0)
+    if args.batch:
+        HEADLESS = HEADLESS or args.headless
+        ok = run_batch(args.batch, args.out)
+        if args.stats:
+            METRICS.export(args.stats)
+        sys.exit(0 if ok else 1)
     try:
-        main()
-    except KeyboardInterrupt:
+        main(headless=args.headless, wake=args.wake)
+    except (KeyboardInterrupt, EOFError):
+        ENGINE.cancel()
         respond(ENGINE, "Interrupted. Goodbye.", pause=0.1)
+        ENGINE.wait_idle(timeout=3)
         sys.exit(0)
@@ -0,0 +1,188 @@
+"""Load test for `python Py.py --serve`.
+
+Usage: python loadtest.py [--sessions 128] [--rounds 3] [--url http://127.0.0.1:8765] [--json FILE]
+
+Without --url it starts its own headless server on a free port inside a
+scratch directory. Every simulated user opens a session on its own keep-alive
+connection and runs CONVERSATION: one-shot commands plus multi-prompt ones
+(each answer is its own request). Each user also picks its own voice mode and
+checks that the replies and its history only ever show its own state.
+
+Prints throughput and p50/p95/p99 request latency; exits 1 on any error or
+cross-session leak, or when p99 exceeds --max-p99-ms.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import tempfile
+import argparse
+import subprocess
+import statistics
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+VOICES = ["calm", "balanced", "energetic"]
+
+# (command, answers to the prompts it asks)
+CONVERSATION = [
+    ("hello", []),
+    ("what time is it", []),
+    ("what is 12 times 7 plus 3", []),
+    ("weight", ["70", "K"]),
+    ("next prime after 100000", []),
+    ("factor 600851475143", []),
+    ("temperature", ["100", "C"]),
+    ("draw", ["star", "red", "50", "5"]),
+    ("game", ["rock"]),
+    ("history", []),
+]
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+class Client:
+    # one keep-alive HTTP/1.1 connection speaking JSON
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = self.writer = None
+
+    async def request(self, method, path, payload=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        body = json.dumps(payload).encode("utf-8") if payload is not None else b""
+        self.writer.write((f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\n"
+                           f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n").encode("latin-1") + body)
+        await self.writer.drain()
+        status = int((await self.reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            key, _, value = line.decode("latin-1").partition(":")
+            if key.strip().lower() == "content-length":
+                length = int(value)
+        data = json.loads(await self.reader.readexactly(length)) if length else {}
+        return status, data
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            await self.writer.wait_closed()
+
+
+async def run_user(n, host, port, rounds, latencies, errors):
+    client = Client(host, port)
+    voice = VOICES[n % len(VOICES)]
+
+    async def call(method, path, payload=None):
+        start = time.perf_counter()
+        status, data = await client.request(method, path, payload)
+        latencies.append((time.perf_counter() - start) * 1000)
+        if status >= 400:
+            raise RuntimeError(f"{method} {path} -> {status} {data.get('error')}")
+        return data
+
+    try:
+        sid = (await call("POST", "/sessions", {"voice": "calm"}))["session"]
+        data = await call("POST", f"/sessions/{sid}", {"text": f"set voice {voice}"})
+        if data["voice"]["mode"] != voice:
+            raise RuntimeError(f"session {sid} asked for {voice}, got {data['voice']['mode']}")
+        for _ in range(rounds):
+            for command, answers in CONVERSATION:
+                data = await call("POST", f"/sessions/{sid}", {"text": command})
+                for answer in answers:
+                    if not data.get("prompt"):
+                        raise RuntimeError(f"{command!r}: expected a prompt before answering {answer!r}")
+                    data = await call("POST", f"/sessions/{sid}", {"text": answer})
+                if data.get("prompt") or data.get("pending"):
+                    raise RuntimeError(f"{command!r} did not finish: {data}")
+                if data["voice"]["mode"] != voice:
+                    raise RuntimeError(f"session {sid} voice changed to {data['voice']['mode']}")
+        history = (await call("GET", f"/sessions/{sid}/history"))["history"]
+        if any(item.get("session") != sid for item in history):
+            raise RuntimeError(f"session {sid} sees another session's history")
+        await call("POST", f"/sessions/{sid}", {"text": "exit"})
+    except Exception as e:
+        errors.append(f"user {n}: {type(e).__name__}: {e}")
+    finally:
+        await client.close()
+
+
+async def load(host, port, sessions, rounds):
+    latencies, errors = [], []
+    start = time.perf_counter()
+    await asyncio.gather(*(run_user(n, host, port, rounds, latencies, errors) for n in range(sessions)))
+    return time.perf_counter() - start, latencies, errors
+
+
+def start_server(workdir):
+    # a headless server on a free port; returns (process, host, port)
+    env = dict(os.environ, LEXCHAT_HEADLESS="1", LEXCHAT_PHRASE_CACHE="0", PYTHONUNBUFFERED="1")
+    proc = subprocess.Popen([sys.executable, os.path.join(ROOT, "Py.py"), "--serve", "--headless", "--port", "0"],
+                            cwd=workdir, env=env, stdout=subprocess.PIPE, text=True)
+    for line in proc.stdout:
+        if "http://" in line:
+            host, port = line.split("http://", 1)[1].split()[0].rsplit(":", 1)
+            return proc, host, int(port)
+    raise SystemExit(f"server exited before listening (code {proc.wait()})")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Lexchat server load test")
+    parser.add_argument("--sessions", type=int, default=128, help="concurrent users (default 128)")
+    parser.add_argument("--rounds", type=int, default=3, help="times each user runs the conversation (default 3)")
+    parser.add_argument("--url", help="test a running server instead of starting one")
+    parser.add_argument("--max-p99-ms", type=float, help="exit 1 if the p99 request latency is above this")
+    parser.add_argument("--json", metavar="FILE", help="also write the results to FILE")
+    args = parser.parse_args(argv)
+
+    proc = None
+    with tempfile.TemporaryDirectory(prefix="lexchat_load_") as tmp:
+        if args.url:
+            host, port = args.url.split("://", 1)[-1].rstrip("/").rsplit(":", 1)
+            port = int(port)
+        else:
+            proc, host, port = start_server(tmp)
+        try:
+            wall, latencies, errors = asyncio.run(load(host, port, args.sessions, args.rounds))
+        finally:
+            if proc is not None:
+                proc.terminate()
+                proc.wait(timeout=10)
+
+    latencies.sort()
+    result = {
+        "sessions": args.sessions,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "seconds": round(wall, 3),
+        "throughput_rps": round(len(latencies) / wall, 1) if wall else 0.0,
+        **{f"p{p}_ms": round(percentile(latencies, p), 2) for p in (50, 95, 99)},
+        "max_ms": round(latencies[-1], 2) if latencies else 0.0,
+        "mean_ms": round(statistics.fmean(latencies), 2) if latencies else 0.0,
+    }
+    for line in errors[:10]:
+        print("ERROR", line)
+    print(f"{result['sessions']} sessions, {result['requests']} requests in {result['seconds']}s: "
+          f"{result['throughput_rps']} req/s, p50 {result['p50_ms']} ms, p95 {result['p95_ms']} ms, "
+          f"p99 {result['p99_ms']} ms, max {result['max_ms']} ms, {result['errors']} errors")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+    if errors or (args.max_p99_ms is not None and result["p99_ms"] > args.max_p99_ms):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())